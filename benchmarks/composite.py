@@ -0,0 +1,67 @@
+# Micro-benchmark for compositing the layers of the pillow backend: alpha compositing the whole
+# card with Pillow for every badge, against the compositor that only blends the picture window
+# into a base card decoded once per design, one badge or a batch at a time.
+#
+#   uv run python -m benchmarks.composite --members 200
+import statistics
+import time
+from io import BytesIO
+
+import click
+from PIL import Image as PImage
+
+from benchmarks.stub_geekevents import PICTURE_SPECS, make_picture
+
+
+def _full_card(design, layers: tuple, picture: PImage.Image, box) -> PImage.Image:
+    # What the pillow backend did before the compositor
+    background, foreground = layers
+    canvas = PImage.new("RGBA", (design.width_px, design.height_px), f"#{design.background_color}")
+    canvas.alpha_composite(background)
+    canvas.alpha_composite(picture.resize(box.size, PImage.LANCZOS), box[:2])
+    canvas.alpha_composite(foreground)
+    return canvas.convert("RGB")
+
+
+@click.command()
+@click.option("--members", "-n", type=int, default=100, show_default=True, help="Number of different pictures")
+@click.option("--repeat", type=int, default=5, show_default=True, help="Runs over all pictures")
+@click.option("--chunk", type=int, default=8, show_default=True, help="Pictures blended at once in the batch run")
+def main(members: int, repeat: int, chunk: int):
+    from polarbadge.parties.pp33.spec import design
+    from polarbadge.service.compositor import Compositor
+    from polarbadge.service.picture import normalize_picture
+
+    pictures = []
+    for index in range(members):
+        content = normalize_picture(make_picture(index, PICTURE_SPECS[index % len(PICTURE_SPECS)]), design)
+        with PImage.open(BytesIO(content)) as picture:
+            pictures.append(picture.convert("RGBA"))
+
+    started = time.perf_counter()
+    compositor = Compositor(design)
+    click.echo(f"{'layers, once':<16} {(time.perf_counter() - started) * 1000:>10.1f}ms")
+    layers = tuple(PImage.open(image.path).convert("RGBA") for image in (design.background_png, design.foreground_png))
+
+    box = compositor.picture_box
+    for picture in pictures:
+        if compositor.compose([picture])[0].tobytes() != _full_card(design, layers, picture, box).tobytes():
+            raise click.ClickException("Compositor differs from compositing the whole card")
+
+    runs = (
+        ("whole card", lambda: [_full_card(design, layers, picture, box) for picture in pictures]),
+        ("window", lambda: [compositor.compose([picture]) for picture in pictures]),
+        (f"window, {chunk}/batch", lambda: compositor.compose(pictures, chunk=chunk)),
+    )
+    for name, function in runs:
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            function()
+            timings.append((time.perf_counter() - started) * 1000 / members)
+        click.echo(f"{name:<16} p50 {statistics.median(timings):>8.2f}ms "
+                   f"mean {statistics.fmean(timings):>8.2f}ms per badge")
+
+
+if __name__ == "__main__":
+    main()
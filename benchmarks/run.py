@@ -0,0 +1,240 @@
+# Offline benchmarks for the render pipeline. Every case runs in a fresh process against a
+# stub GeekEvents server, so peak RSS is per case and nothing is cached from a previous case.
+#
+#   uv run python -m benchmarks.run --members 50 --raster memory
+#   uv run python -m benchmarks.run --members 50 --raster memory --save-baseline
+import contextlib
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from importlib.metadata import PackageNotFoundError, version
+from multiprocessing import get_context
+
+import click
+
+from benchmarks.stub_geekevents import PARTY_ID, StubGeekEvents
+from polarbadge.models.badge import RASTERIZERS
+
+CASES = ("render_card", "render_to_image", "generate_badges")
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.realpath(__file__)), "baseline.json")
+PACKAGES = ("weasyprint", "pillow", "jinja2", "pydantic", "pypdfium2", "plutoprint")
+
+
+def _peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux, the workers of generate_badges count as children
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return max(own, children) / 1024
+
+
+def _build_jobs():
+    from polarbadge.parties.pp33.cli import _build_job
+    from polarbadge.service.geekevents import get_client
+    return [_build_job(crew) for crew in get_client().get_crew_members().members]
+
+
+# Each case returns the number of badges, the seconds they took and the recorded stage spans
+def _case_render_card(rasterizer: str, jobs: int) -> tuple[int, float, list]:
+    from polarbadge.models.badge import RenderOptions
+    from polarbadge.parties.pp33.spec import design
+    from polarbadge.service.batch import prepare_job_data
+    from polarbadge.service.render import render_card
+    from polarbadge.service.profiling import stage, start_recording, stop_recording
+
+    options = RenderOptions(rasterizer=rasterizer)
+    badge_jobs = _build_jobs()
+    start_recording()
+    started = time.perf_counter()
+    for job in badge_jobs:
+        with stage("badge"):
+            render_card(design=design, barcode_backend=options.barcode_backend, **prepare_job_data(design, job, options))
+    return len(badge_jobs), time.perf_counter() - started, stop_recording()
+
+
+def _case_render_to_image(rasterizer: str, jobs: int) -> tuple[int, float, list]:
+    from polarbadge.models.badge import RenderOptions
+    from polarbadge.parties.pp33.spec import design
+    from polarbadge.service.batch import prepare_job_data
+    from polarbadge.service.output import write_output
+    from polarbadge.service.raster import render_image
+    from polarbadge.service.render import rasterize, render_card
+    from polarbadge.service.profiling import stage, start_recording, stop_recording
+
+    options = RenderOptions(rasterizer=rasterizer)
+    data = [prepare_job_data(design, job, options) for job in _build_jobs()]
+    if rasterizer != "pillow":
+        html = [render_card(design=design, barcode_backend=options.barcode_backend, **item) for item in data]
+    with tempfile.TemporaryDirectory() as output_path:
+        start_recording()
+        started = time.perf_counter()
+        for i, item in enumerate(data):
+            with stage("badge"):
+                if rasterizer == "pillow":
+                    image = render_image(design, barcode_backend=options.barcode_backend, **item)
+                else:
+                    image = rasterize(design, html[i], rasterizer=rasterizer)
+                write_output(os.path.join(output_path, str(i)), design, image, options)
+        return len(data), time.perf_counter() - started, stop_recording()
+
+
+def _case_generate_badges(rasterizer: str, jobs: int) -> tuple[int, float, list]:
+    from polarbadge.parties.pp33.cli import generate_badges
+
+    started = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        results = generate_badges(jobs=jobs, rasterizer=rasterizer, profile=True)
+    seconds = time.perf_counter() - started
+    failed = [result for result in results if not result.ok]
+    if failed:
+        raise RuntimeError(f"{len(failed)} badges failed, first error:\n{failed[0].error}")
+    return len(results), seconds, [span for result in results for span in result.spans]
+
+
+_CASE_FUNCTIONS = {
+    "render_card": _case_render_card,
+    "render_to_image": _case_render_to_image,
+    "generate_badges": _case_generate_badges,
+}
+
+
+def _run_case(case: str, rasterizer: str, jobs: int) -> dict:
+    from polarbadge.service.profiling import StageReport
+
+    badges, seconds, spans = _CASE_FUNCTIONS[case](rasterizer, jobs)
+    return {
+        "badges": badges,
+        "seconds": seconds,
+        "badges_per_s": badges / seconds,
+        "peak_rss_mb": _peak_rss_mb(),
+        "stages_p50_ms": {row["stage"]: row["p50_ms"] for row in StageReport(spans).summary()},
+    }
+
+
+def _write_config(path: str, base_url: str) -> str:
+    config_path = os.path.join(path, "config.toml")
+    with open(config_path, "w") as f:
+        f.write(
+            "[general]\n"
+            f"output_path = {json.dumps(os.path.join(path, 'output'))}\n"
+            f"cache_path = {json.dumps(os.path.join(path, 'cache'))}\n"
+            "\n"
+            "[geekevents]\n"
+            'username = "bench"\n'
+            'secret = "bench"\n'
+            f"base_url = {json.dumps(base_url)}\n"
+            f"party_id = {PARTY_ID}\n"
+        )
+    os.makedirs(os.path.join(path, "output"))
+    return config_path
+
+
+def _environment(members: int, rasterizer: str, jobs: int) -> dict:
+    packages = {}
+    for package in PACKAGES:
+        try:
+            packages[package] = version(package)
+        except PackageNotFoundError:
+            packages[package] = None
+    return {
+        "members": members,
+        "rasterizer": rasterizer,
+        "jobs": jobs,
+        "python": platform.python_version(),
+        "machine": platform.node(),
+        "packages": packages,
+    }
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    # Lists what got worse than the baseline by more than the tolerance (a fraction)
+    regressions = []
+    for case, result in results.items():
+        base = baseline.get(case)
+        if not base:
+            continue
+        if result["badges_per_s"] < base["badges_per_s"] * (1 - tolerance):
+            regressions.append(f"{case}: {result['badges_per_s']:.2f} badges/s, "
+                               f"baseline {base['badges_per_s']:.2f}")
+        if result["peak_rss_mb"] > base["peak_rss_mb"] * (1 + tolerance):
+            regressions.append(f"{case}: peak RSS {result['peak_rss_mb']:.0f} MiB, "
+                               f"baseline {base['peak_rss_mb']:.0f} MiB")
+        for name, p50_ms in result["stages_p50_ms"].items():
+            base_ms = base["stages_p50_ms"].get(name)
+            # Sub-millisecond stages jitter too much to compare relatively
+            if base_ms is not None and p50_ms > base_ms * (1 + tolerance) and p50_ms - base_ms > 1:
+                regressions.append(f"{case}: stage {name} p50 {p50_ms:.1f}ms, baseline {base_ms:.1f}ms")
+    return regressions
+
+
+@click.command()
+@click.option("--members", "-n", type=int, default=50, show_default=True, help="Size of the synthetic crew")
+@click.option("--raster", "rasterizer", type=click.Choice(RASTERIZERS), default="poppler", show_default=True)
+@click.option("--jobs", "-j", type=int, default=1, show_default=True,
+              help="Worker processes for the generate_badges case")
+@click.option("--case", "cases", type=click.Choice(CASES), multiple=True, help="Only these cases (default all)")
+@click.option("--baseline", "baseline_path", default=DEFAULT_BASELINE, show_default=True)
+@click.option("--save-baseline", is_flag=True, help="Store this run as the new baseline")
+@click.option("--tolerance", type=float, default=0.1, show_default=True,
+              help="Allowed slowdown before a result counts as a regression")
+def main(
+        members: int,
+        rasterizer: str,
+        jobs: int,
+        cases: tuple[str, ...],
+        baseline_path: str,
+        save_baseline: bool,
+        tolerance: float
+):
+    environment = _environment(members, rasterizer, jobs)
+    results = {}
+    server = StubGeekEvents(members).start()
+    try:
+        for case in cases or CASES:
+            with tempfile.TemporaryDirectory(prefix="polarbadge-bench-") as path:
+                os.environ["POLARBADGE_CONFIG"] = _write_config(path, server.base_url)
+                # A fresh interpreter per case, so imports, caches and peak RSS don't carry over
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+                    results[case] = executor.submit(_run_case, case, rasterizer, jobs).result()
+            result = results[case]
+            click.echo(f"{case:<16} {result['badges']:>5} badges {result['badges_per_s']:>8.2f}/s "
+                       f"peak RSS {result['peak_rss_mb']:>6.0f} MiB")
+            for name, p50_ms in result["stages_p50_ms"].items():
+                click.echo(f"    {name:<18} p50 {p50_ms:>8.1f}ms")
+    finally:
+        server.stop()
+
+    if save_baseline:
+        with open(baseline_path, "w") as f:
+            json.dump({"environment": environment, "results": results}, f, indent=2)
+        click.secho(f"Saved baseline to {baseline_path}", fg="green")
+        return
+
+    if not os.path.exists(baseline_path):
+        click.echo("No baseline to compare with, store one with --save-baseline")
+        return
+
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    changed = {key for key in ("members", "rasterizer", "jobs") if baseline["environment"].get(key) != environment[key]}
+    if changed:
+        click.secho(f"Baseline was run with different {', '.join(sorted(changed))}, results are not comparable",
+                    fg="yellow")
+    for package, installed in environment["packages"].items():
+        if baseline["environment"]["packages"].get(package) != installed:
+            click.echo(f"{package}: {baseline['environment']['packages'].get(package)} -> {installed}")
+
+    regressions = compare(results, baseline["results"], tolerance)
+    for regression in regressions:
+        click.secho(f"Regression: {regression}", fg="red")
+    if regressions:
+        sys.exit(1)
+    click.secho("No regressions against the baseline", fg="green")
+
+
+if __name__ == "__main__":
+    main()
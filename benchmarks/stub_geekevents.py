@@ -0,0 +1,126 @@
+import hashlib
+import http.server
+import json
+import threading
+from io import BytesIO
+from typing import NamedTuple
+
+from PIL import Image as PImage
+
+PARTY_ID = 1
+
+
+class PictureSpec(NamedTuple):
+    width: int
+    height: int
+    format: str
+    mode: str
+
+
+# What crew members actually upload: phone photos, small avatars, transparent PNGs and WebP
+PICTURE_SPECS = [
+    PictureSpec(400, 400, "JPEG", "RGB"),
+    PictureSpec(1200, 900, "JPEG", "RGB"),
+    PictureSpec(3024, 4032, "JPEG", "RGB"),
+    PictureSpec(800, 800, "PNG", "RGBA"),
+    PictureSpec(1024, 768, "WEBP", "RGB"),
+]
+
+
+def make_picture(index: int, spec: PictureSpec) -> bytes:
+    # Deterministic gradients, so every run compresses and decodes the same pixels
+    width, height = spec.width, spec.height
+    red = PImage.linear_gradient("L").resize((width, height))
+    green = PImage.radial_gradient("L").resize((width, height))
+    blue = PImage.new("L", (width, height), index * 37 % 256)
+    image = PImage.merge("RGB", (red, green, blue))
+    if spec.mode == "RGBA":
+        image.putalpha(green)
+
+    buffer = BytesIO()
+    image.save(buffer, format=spec.format, quality=85)
+    return buffer.getvalue()
+
+
+def make_crew(members: int) -> tuple[dict[str, dict], dict[str, bytes]]:
+    # Returns the crew list the way GeekEvents serves it, and the pictures by URL path
+    crew = {}
+    pictures = {}
+    for index in range(members):
+        user_id = index + 1
+        spec = PICTURE_SPECS[index % len(PICTURE_SPECS)]
+        path = f"/media/profile/{user_id}.{spec.format.lower()}"
+        crew[str(user_id)] = {
+            "user_id": user_id,
+            "username": f"crew{user_id}",
+            "email": f"crew{user_id}@example.org",
+            "first_name": f"First{user_id}",
+            "last_name": f"Last{user_id}",
+            "phone": "",
+            "address1": "",
+            "address2": "",
+            "postal_code": "",
+            "postal_name": "",
+            "user_card": f"{user_id:010d}",
+            "profile_image": path,
+            "crew": ["Tech:Network", "Info", "Game:Compo", "Security"][index % 4],
+            "role": "member",
+        }
+        pictures[path] = make_picture(index, spec)
+    return crew, pictures
+
+
+class StubGeekEvents:
+    # Serves a synthetic crew list and profile pictures on localhost, with ETag revalidation
+    # like the real site, so the whole pipeline runs without network access
+    def __init__(self, members: int):
+        self.crew, self.pictures = make_crew(members)
+        self._server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _handler(self):
+        crew_list = json.dumps(self.crew).encode("utf-8")
+        pictures = self.pictures
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path == f"/event/{PARTY_ID}/crew/api/crew-list/":
+                    body = crew_list
+                elif self.path in pictures:
+                    body = pictures[self.path]
+                else:
+                    self.send_error(404)
+                    return
+
+                etag = '"' + hashlib.sha1(body).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    self.send_response(304)
+                    self.send_header("Content-Length", "0")
+                    self.end_headers()
+                    return
+
+                self.send_response(200)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> "StubGeekEvents":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
@@ -0,0 +1,61 @@
+# Micro-benchmark for the card template: rendering the whole card.html.j2 for every badge
+# against filling the subject into the card skeleton that is rendered once per design.
+#
+#   uv run python -m benchmarks.template --members 200
+import statistics
+import time
+
+import click
+
+from benchmarks.stub_geekevents import PICTURE_SPECS, make_picture
+
+
+def _time_us(function, context: dict, repeat: int) -> list[float]:
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        function(context)
+        timings.append((time.perf_counter() - started) * 1_000_000)
+    return timings
+
+
+@click.command()
+@click.option("--members", "-n", type=int, default=100, show_default=True, help="Number of different subjects")
+@click.option("--repeat", type=int, default=20, show_default=True, help="Renders per subject")
+def main(members: int, repeat: int):
+    from polarbadge.parties.pp33.spec import design
+    from polarbadge.service.render import (
+        build_subject, compile_design, get_card_skeleton, render_to_string, render_to_string_full
+    )
+
+    compiled = compile_design(design)
+    contexts = []
+    for index in range(members):
+        user_id = index + 1
+        subject = build_subject(
+            design,
+            nick=f"crew{user_id}",
+            name=f"First{user_id} Last{user_id}",
+            crew="Tech:Network",
+            user_id=user_id,
+            profile_picture_content=make_picture(index, PICTURE_SPECS[0])
+        )
+        contexts.append({"design": design, "compiled": compiled, "card": design.card, "subject": subject,
+                         "debug": False})
+
+    started = time.perf_counter()
+    get_card_skeleton(design)
+    click.echo(f"{'skeleton, once':<16} {(time.perf_counter() - started) * 1_000_000:>10.1f}us")
+
+    for context in contexts:
+        if render_to_string(context) != render_to_string_full(context):
+            raise click.ClickException(f"Two-phase render differs for user {context['subject']['user_id']}")
+
+    for name, function in (("full template", render_to_string_full), ("two-phase", render_to_string)):
+        timings = [us for context in contexts for us in _time_us(function, context, repeat)]
+        click.echo(f"{name:<16} p50 {statistics.median(timings):>8.1f}us "
+                   f"mean {statistics.fmean(timings):>8.1f}us per badge")
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,9 @@ def cli():
 
 cli.command(pp33_cli.pp33_everyone)
 cli.command(pp33_cli.pp33_users)
+cli.command(pp33_cli.pp33_sheet)
+cli.command(pp33_cli.pp33_compare)
+cli.command(pp33_cli.pp33_serve)
 cli.command(pp33_cli.register)
 
 
@@ -0,0 +1,79 @@
+from typing import Any, Literal, get_args
+
+from pydantic import BaseModel
+
+# "pillow" draws the card from the design directly, the others rasterize the card HTML
+Rasterizer = Literal["poppler", "memory", "plutoprint", "pillow"]
+BarcodeBackend = Literal["native", "treepoem"]
+SheetLayout = Literal["pages", "a4"]
+# See polarbadge.service.output
+OutputFormat = Literal["bmp", "png", "rgb", "cmyk"]
+
+RASTERIZERS: tuple[str, ...] = get_args(Rasterizer)
+HTML_RASTERIZERS: tuple[str, ...] = tuple(rasterizer for rasterizer in RASTERIZERS if rasterizer != "pillow")
+BARCODE_BACKENDS: tuple[str, ...] = get_args(BarcodeBackend)
+LAYOUTS: tuple[str, ...] = get_args(SheetLayout)
+OUTPUT_FORMATS: tuple[str, ...] = get_args(OutputFormat)
+
+
+class RenderOptions(BaseModel):
+    rasterizer: Rasterizer = "poppler"
+    barcode_backend: BarcodeBackend = "native"
+    face_crop: bool = True
+    output_format: OutputFormat = "bmp"
+    # Also write a 1-bit resin panel for black text and barcodes
+    k_panel: bool = False
+    # Where normalized pictures are memoized, None disables it
+    cache_path: str | None = None
+    # Record per-stage timings in BadgeResult.spans
+    profile: bool = False
+    # Memory-bounded rendering, see polarbadge.service.memory: a ceiling per worker process in MiB,
+    # and how many badges a worker renders before it is replaced by a fresh one (None is no limit)
+    max_memory_mb: int | None = None
+    badges_per_worker: int | None = None
+
+    @property
+    def memory_bounded(self) -> bool:
+        return self.max_memory_mb is not None or self.badges_per_worker is not None
+
+
+class BadgeJob(BaseModel):
+    user_id: int
+    full_name: str
+    file_path: str
+    # Keyword arguments for render_card (excluding the design)
+    data: dict[str, Any]
+    # One of the batch's designs by name, None for its default design, see polarbadge.models.card.Party
+    design: str | None = None
+
+
+class StageSpan(BaseModel):
+    # One timed stage of the pipeline, see polarbadge.service.profiling
+    stage: str
+    start_s: float
+    wall_s: float
+    cpu_s: float
+    bytes: int = 0
+    # Resident memory of the process after the stage, or the new peak if the stage raised it
+    rss_bytes: int = 0
+    pid: int
+    tid: int
+    args: dict[str, Any] = {}
+
+
+class BadgeResult(BaseModel):
+    user_id: int
+    full_name: str
+    file_path: str
+    error: str | None = None
+    elapsed_s: float = 0
+    files: list[str] = []
+    spans: list[StageSpan] = []
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def print_files(self) -> list[str]:
+        return [file for file in self.files if not file.endswith(".html")]
@@ -4,13 +4,23 @@ from pathlib import Path
 from typing import Self, Literal
 
 
-from pydantic import BaseModel, model_validator
-from PIL import Image as PImage
+from pydantic import BaseModel, ValidationInfo, model_validator
 
 
 SizeMM = Decimal
 CSSOptions = dict[str, int|str]
 
+# Validation context for a design loaded from its cached form, whose layers were already checked
+# when it was first built, see polarbadge.service.designs
+ASSETS_CHECKED = "assets_checked"
+# Name of the design a party uses for everyone no design rule matches
+DEFAULT_DESIGN = "default"
+
+
+def _assets_checked(info: ValidationInfo) -> bool:
+    return bool(info.context and info.context.get(ASSETS_CHECKED))
+
+
 class CardType(BaseModel):
     name: str
     width_mm: SizeMM
@@ -121,8 +131,9 @@ class Design(BaseModel):
     code_2d_box: Code2DBox | None = None
 
     @model_validator(mode='after')
-    def check_background_correct_size(self) -> Self:
-        if self.background_png:
+    def check_background_correct_size(self, info: ValidationInfo) -> Self:
+        if self.background_png and not _assets_checked(info):
+            from PIL import Image as PImage
             image = PImage.open(self.background_png.path)
             width, height = image.size
             required_width, required_height = self.width_px, self.height_px
@@ -134,8 +145,9 @@ class Design(BaseModel):
         return self
 
     @model_validator(mode='after')
-    def check_foreground_correct_size(self) -> Self:
-        if self.foreground_png:
+    def check_foreground_correct_size(self, info: ValidationInfo) -> Self:
+        if self.foreground_png and not _assets_checked(info):
+            from PIL import Image as PImage
             image = PImage.open(self.foreground_png.path)
             width, height = image.size
             required_width, required_height = self.width_px, self.height_px
@@ -168,6 +180,13 @@ class Design(BaseModel):
     def height_px(self) -> int:
         return self.card.height_px if self.is_portrait else self.card.width_px
 
+    @property
+    def dpi(self) -> Decimal:
+        return Decimal(self.width_px) / (self.width_mm / Decimal("25.4"))
+
+    def mm_to_px(self, mm: SizeMM) -> int:
+        return round(mm / Decimal("25.4") * self.dpi)
+
     @property
     def background_b64(self) -> str | None:
         if self.background_png:
@@ -203,4 +222,58 @@ class Design(BaseModel):
                         continue
                     found_fonts[font.family_name] = font
 
-        return list(found_fonts.values())
\ No newline at end of file
+        return list(found_fonts.values())
+
+
+class DesignRule(BaseModel):
+    # Gives members of a crew and/or with a role another design than the party's default
+    design: str
+    crew: str | None = None
+    role: str | None = None
+
+    def matches(self, crew: str, role: str) -> bool:
+        return (self.crew is None or self.crew == crew) and (self.role is None or self.role == role)
+
+
+class Party(BaseModel):
+    # The designs of one party package, see polarbadge.service.designs
+    name: str
+    designs: dict[str, Design]
+    # Checked in order, the first one that matches picks the design
+    rules: list[DesignRule] = []
+
+    @model_validator(mode='after')
+    def check_design_names(self) -> Self:
+        if DEFAULT_DESIGN not in self.designs:
+            raise ValueError(f"Party {self.name} has no '{DEFAULT_DESIGN}' design")
+        for rule in self.rules:
+            if rule.design not in self.designs:
+                raise ValueError(f"Design rule refers to unknown design '{rule.design}' (must be one of "
+                                 f"{', '.join(self.designs)})")
+        return self
+
+    @property
+    def default_design(self) -> Design:
+        return self.designs[DEFAULT_DESIGN]
+
+    def select_design(self, crew: str, role: str) -> str | None:
+        # Name of the design for a crew member, None for the default design
+        for rule in self.rules:
+            if rule.matches(crew, role):
+                return None if rule.design == DEFAULT_DESIGN else rule.design
+        return None
+
+
+class CompiledDesign(BaseModel):
+    # Static parts of a design, computed once and shared by every badge rendered with it
+    design: Design
+    background_b64: str | None = None
+    foreground_b64: str | None = None
+    external_fonts: list[ExternalFontFamily] = []
+    # Style block for a single card document
+    css: str = ""
+    # Style block for documents with many cards, see polarbadge.service.imposition
+    sheet_css: str = ""
+    # Card documents split around the subject fields, keyed by (debug, has code), see
+    # polarbadge.service.render.render_to_string
+    card_skeletons: dict[tuple[bool, bool], tuple[tuple[str, ...], tuple[str, ...]]] = {}
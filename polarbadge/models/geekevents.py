@@ -1,3 +1,5 @@
+from typing import NamedTuple
+
 from pydantic import BaseModel, PositiveInt
 
 
@@ -22,6 +24,22 @@ class CrewMember(BaseModel):
         return f"{self.first_name} {self.last_name}"
 
 
+class CrewMemberSummary(NamedTuple):
+    # The fields badges are made from, as a plain tuple. Read from the roster's columns without
+    # validation, a full CrewMember is only built when the rest is needed.
+    user_id: int
+    username: str
+    first_name: str
+    last_name: str
+    profile_image: str
+    crew: str
+    role: str
+
+    @property
+    def full_name(self) -> str:
+        return f"{self.first_name} {self.last_name}"
+
+
 class CrewMemberList(BaseModel):
     members: list[CrewMember]
 
@@ -31,3 +49,13 @@ class GEConfig(BaseModel):
     username: str
     secret: str
     party_id: int
+    # Seconds to wait for a connection and between bytes of a response
+    connect_timeout_s: float = 5
+    read_timeout_s: float = 30
+    # Retries of failed GETs (connection errors, timeouts, 429 and 5xx). The first one is right
+    # away, then they wait backoff_s * 2^(retry - 1) (1s, 2s, 4s) plus up to backoff_jitter_s.
+    retries: int = 4
+    backoff_s: float = 0.5
+    backoff_jitter_s: float = 0.5
+    # Kept-alive connections to GeekEvents, at least as many as pictures fetched concurrently
+    pool_size: int = 16
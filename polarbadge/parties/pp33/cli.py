@@ -1,95 +1,588 @@
 import os
 import re
+import signal
+import time
 
 import click
 
-from polarbadge.service.geekevents import get_client
+from polarbadge.models.badge import (
+    BARCODE_BACKENDS, HTML_RASTERIZERS, LAYOUTS, OUTPUT_FORMATS, RASTERIZERS, BadgeJob, BadgeResult, RenderOptions
+)
+from polarbadge.models.card import DEFAULT_DESIGN
+from polarbadge.models.geekevents import CrewMemberSummary
 from polarbadge.service.config import get_config
-from polarbadge.service.render import render_card, render_to_image
-from .spec import design
 
-_client = get_client()
-_config = get_config()
+# Rendering pulls in WeasyPrint, Pillow and requests, which are only imported once a command
+# actually runs, so `--help` and shell completion stay fast.
 
 REGEX_UUID = re.compile(r"^[0-9a-f\-]{30,50}$")
 
-def pp33_everyone():
-    generate_badges()
+# The designs of this package, see polarbadge.service.designs
+PARTY = "pp33"
+
+# How a badge is rendered, shared by the batch commands and pp33-serve
+_RENDER_OPTIONS = [
+    click.option("--raster", "rasterizer", type=click.Choice(RASTERIZERS), default="poppler", show_default=True,
+                 help="How the card HTML is turned into an image"),
+    click.option("--barcode", "barcode_backend", type=click.Choice(BARCODE_BACKENDS), default="native",
+                 show_default=True, help="DataMatrix encoder"),
+    click.option("--face-crop/--no-face-crop", default=True, show_default=True,
+                 help="Crop profile pictures around the face before embedding them"),
+    click.option("--output", "output_format", type=click.Choice(OUTPUT_FORMATS), default="bmp", show_default=True,
+                 help="Badge file format: bmp, png for archiving, or raw rgb/cmyk panels for the printer"),
+    click.option("--k-panel/--no-k-panel", default=False, show_default=True,
+                 help="Also write a 1-bit resin panel (.k) with black text and barcodes"),
+]
+
+def _check_stream(ctx: click.Context, param: click.Parameter, value: str | None) -> str | None:
+    if value:
+        from polarbadge.service.spool import parse_sink_spec
+        try:
+            parse_sink_spec(value)
+        except ValueError as e:
+            raise click.BadParameter(str(e))
+    return value
+
+
+def _open_sink(stream: str):
+    from polarbadge.service.spool import get_sink
+    try:
+        return get_sink(stream)
+    except OSError as e:
+        raise click.ClickException(f"Could not open the printer spool {stream}: {e}")
+
+
+_STREAM_OPTION = click.option(
+    "--stream", metavar="TYPE:PATH", default=None, callback=_check_stream,
+    help="Hand finished badges to a printer spool as they are done: dir:PATH, fifo:PATH or unix:PATH"
+)
+
+_BADGE_OPTIONS = [
+    click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, show_default=True,
+                 help="Number of worker processes rendering badges in parallel"),
+    *_RENDER_OPTIONS,
+    click.option("--fetch-jobs", type=click.IntRange(min=1), default=8, show_default=True,
+                 help="Number of profile pictures downloaded concurrently"),
+    click.option("--incremental/--full", default=False, show_default=True,
+                 help="Only re-render badges whose inputs changed since the last run"),
+    _STREAM_OPTION,
+    click.option("--profile/--no-profile", default=False, show_default=True,
+                 help="Time every stage of the pipeline and print p50/p95/max per stage"),
+    click.option("--trace", "trace_path", metavar="PATH", default=None,
+                 help="Write the stage timings as a Chrome trace (implies --profile)"),
+    click.option("--resume", is_flag=True,
+                 help="Skip the badges an interrupted or partly failed run of the same badges already finished"),
+    click.option("--max-memory", "max_memory_mb", type=click.IntRange(min=1), default=None, metavar="MIB",
+                 help="Memory ceiling per worker process, badges that need more fail instead of the machine swapping"),
+    click.option("--recycle-after", "badges_per_worker", type=click.IntRange(min=1), default=None, metavar="N",
+                 help="Replace each worker process with a fresh one after N badges"),
+]
+
+
+def badge_options(f):
+    for option in reversed(_BADGE_OPTIONS):
+        f = option(f)
+    return f
+
+
+def render_options(f):
+    for option in reversed(_RENDER_OPTIONS):
+        f = option(f)
+    return f
+
+
+@badge_options
+def pp33_everyone(**options):
+    generate_badges(**options)
 
 @click.option("--user", "-u", multiple=True)
-def pp33_users(user: list[int]):
-    users = list(map(int, user))
-    generate_badges(user_ids=users)
+@click.option("--crew", multiple=True, help="Everyone in these crews")
+@badge_options
+def pp33_users(user: list[int], crew: list[str], **options):
+    users = list(map(int, user)) if user else None
+    generate_badges(user_ids=users, crews=list(crew) or None, **options)
+
+
+def _get_roster(offline: bool = False):
+    # The local crew roster, synced with GeekEvents first unless offline. Falls back to the last
+    # snapshot when GeekEvents can't be reached.
+    import requests
+
+    from polarbadge.service.geekevents import get_client
+    from polarbadge.service.roster import ROSTER_FILENAME, RosterStore
+
+    roster_path = os.path.join(get_config().general.cache_dir, ROSTER_FILENAME)
+    roster = RosterStore(roster_path)
+    if not offline:
+        try:
+            sync = roster.sync(get_client())
+            if not sync.not_modified:
+                click.echo(f"Crew roster synced: {sync.added} added, {sync.updated} updated, {sync.removed} removed")
+            return roster
+        except requests.RequestException as e:
+            if not len(roster):
+                raise click.ClickException(f"GeekEvents unreachable and no cached roster at {roster_path}: {e}")
+            click.secho(f"Could not sync the crew roster: {e}", fg="yellow")
+
+    if not len(roster):
+        raise click.ClickException("There is no local crew roster yet, run once while online")
+    synced_at = time.strftime("%Y-%m-%d %H:%M", time.localtime(roster.synced_at))
+    click.secho(f"Using the crew roster from {synced_at}", fg="yellow")
+    return roster
+
+def _get_party():
+    from polarbadge.service.designs import get_party
+    return get_party(PARTY)
+
+
+def _build_job(crew: CrewMemberSummary) -> BadgeJob:
+    from polarbadge.service.geekevents import get_client
+
+    profile_pic = get_client().get_picture(crew.profile_image)
+    filename = f"{crew.user_id}-{crew.full_name.replace(' ', '')}"
+    file_path = os.path.join(get_config().general.output_path, filename)
+
+    crew_name = crew.crew.replace("_", ":").replace(" ", ":").replace("::", ":").replace(":", "\n")
+
+    data = {
+        "name": crew.first_name,
+        "nick": crew.username,
+        "crew": crew_name,
+        "profile_picture_content": profile_pic,
+        "user_id": crew.user_id,
+    }
+
+    if REGEX_UUID.match(crew.username):
+        click.secho(f"\tUser {crew.user_id} has UUID for nick, using first name as nick", fg="yellow")
+        data["name"] = ""
+        data["nick"] = crew.first_name
+
+    return BadgeJob(
+        user_id=crew.user_id,
+        full_name=crew.full_name,
+        file_path=file_path,
+        data=data,
+        design=_get_party().select_design(crew.crew, crew.role)
+    )
+
+def generate_badges(
+        user_ids: list | None = None,
+        crews: list | None = None,
+        jobs: int = 1,
+        rasterizer: str = "poppler",
+        barcode_backend: str = "native",
+        face_crop: bool = True,
+        output_format: str = "bmp",
+        k_panel: bool = False,
+        fetch_jobs: int = 8,
+        incremental: bool = False,
+        stream: str | None = None,
+        profile: bool = False,
+        trace_path: str | None = None,
+        resume: bool = False,
+        max_memory_mb: int | None = None,
+        badges_per_worker: int | None = None
+) -> list[BadgeResult]:
+    import requests
+
+    from polarbadge.service.batch import iter_batch
+    from polarbadge.service.geekevents import get_client
+    from polarbadge.service.incremental import BadgeManifest, badge_fingerprint, design_fingerprint
+    from polarbadge.service.journal import RunJournal, run_key
+    from polarbadge.service.profiling import StageReport, start_recording, stop_recording
+
+    client = get_client()
+    config = get_config()
+    party = _get_party()
+    profile = profile or trace_path is not None
+    if profile:
+        # Stages in this process (fetching crew and pictures), the badges bring their own spans
+        start_recording()
 
-def generate_badges(user_ids: list | None = None):
     click.echo("Generating badges...")
-    crew_members = _client.get_crew_members().members
-    if user_ids is not None:
-        crew_members = [crew_member for crew_member in crew_members if crew_member.user_id in user_ids]
+    crew_members = _get_roster().summaries(user_ids=user_ids, crews=crews)
 
     number_of_crew_members = len(crew_members)
     click.echo(f"Generating badge for {number_of_crew_members} crew members, output path "
-               f"{_config.general.output_path}")
-    for i, crew in enumerate(crew_members):
-        profile_pic = _client.get_picture(crew.profile_image)
-        filename = f"{crew.user_id}-{crew.full_name.replace(' ', '')}"
-        file_path = os.path.join(_config.general.output_path, filename)
+               f"{config.general.output_path}")
+
+    options = RenderOptions(
+        rasterizer=rasterizer,
+        barcode_backend=barcode_backend,
+        face_crop=face_crop,
+        output_format=output_format,
+        k_panel=k_panel,
+        cache_path=config.general.cache_dir,
+        profile=profile,
+        max_memory_mb=max_memory_mb,
+        badges_per_worker=badges_per_worker
+    )
+    if max_memory_mb:
+        from polarbadge.service.memory import check_memory_limit
+        try:
+            check_memory_limit(max_memory_mb)
+        except ValueError as e:
+            raise click.ClickException(str(e))
+    manifest = BadgeManifest(config.general.output_path)
+    # Only the options that change what a badge looks like
+    look = options.model_dump(exclude={"cache_path", "profile", "max_memory_mb", "badges_per_worker"})
+    design_hashes = {name: design_fingerprint(design, look) for name, design in party.designs.items()}
+    fingerprints = {}
+
+    journal = RunJournal(
+        config.general.output_path,
+        run_key(
+            ":".join(design_hashes[name] for name in sorted(design_hashes)),
+            {"user_ids": sorted(user_ids or []), "crews": sorted(crews or [])}
+        ),
+        resume=resume
+    )
+    if journal.completed:
+        click.echo(f"Resuming, {len(journal.completed)} badges were already done")
+    pending_members = [crew for crew in crew_members if crew.user_id not in journal.completed]
+    resumed = number_of_crew_members - len(pending_members)
+
+    click.echo("Fetching profile pictures...")
+    failures = client.prefetch_pictures([crew.profile_image for crew in pending_members], workers=fetch_jobs)
+    if failures:
+        click.secho(f"Could not prefetch {len(failures)} pictures, retrying while rendering", fg="yellow")
 
-        crew_name = crew.crew.replace("_", ":").replace(" ", ":").replace("::", ":").replace(":", "\n")
+    removed = 0
+    # Only a run over everyone knows which crew members are gone
+    if incremental and user_ids is None and crews is None:
+        current_user_ids = {crew.user_id for crew in crew_members}
+        for user_id in manifest.user_ids - current_user_ids:
+            manifest.remove(user_id)
+            removed += 1
 
-        data = {
-            "name": crew.first_name,
-            "nick": crew.username,
-            "crew": crew_name,
-            "profile_picture_content": profile_pic,
-            "user_id": crew.user_id,
-        }
+    results = []
+    skipped = 0
 
-        if REGEX_UUID.match(crew.username):
-            click.secho("\tUser has UUID for nick, using first name as nick", fg="yellow")
-            data["name"] = ""
-            data["nick"] = crew.first_name
+    def iter_jobs():
+        # Jobs are built lazily, so only the badges in flight hold their picture in memory
+        nonlocal skipped
+        for crew in pending_members:
+            try:
+                job = _build_job(crew)
+            except requests.RequestException as e:
+                click.secho(f"Could not fetch picture for {crew.full_name}: {e}", fg="red")
+                results.append(BadgeResult(user_id=crew.user_id, full_name=crew.full_name, file_path="", error=str(e)))
+                continue
 
-        html = render_card(design=design, **data)
-        with open(file_path + ".html", "w") as f:
-            f.write(html)
+            fingerprints[job.user_id] = badge_fingerprint(design_hashes[job.design or DEFAULT_DESIGN], job)
+            if incremental and manifest.is_current(job.user_id, fingerprints[job.user_id]):
+                skipped += 1
+                journal.record(job.user_id)
+                continue
+            yield job
 
-        render_to_image(file_path + ".bmp", design, html)
+    sink = _open_sink(stream) if stream else None
+    try:
+        for _, result in iter_batch(
+                party.default_design, iter_jobs(), workers=jobs, options=options, designs=party.designs
+        ):
+            results.append(result)
+            done = len(results) + skipped + resumed
+            if result.ok:
+                manifest.update(result, fingerprints[result.user_id])
+                journal.record(result.user_id)
+                if sink:
+                    try:
+                        sink.send(result)
+                    except OSError as e:
+                        raise click.ClickException(f"Could not hand {result.full_name} to the printer spool "
+                                                   f"{stream}: {e}")
+                click.secho(f"{done}/{number_of_crew_members} - Generated badge for {result.full_name} "
+                            f"({result.elapsed_s * 1000:.0f}ms)", fg="blue")
+            else:
+                click.secho(f"{done}/{number_of_crew_members} - Failed badge for {result.full_name}", fg="red")
+    finally:
+        manifest.save()
+        journal.close()
+        if sink:
+            sink.close()
 
-        click.secho(f"{i+1}/{number_of_crew_members} - Generating badge for {crew.full_name}", fg="blue")
+    failed = [result for result in results if not result.ok]
+    rendered = [result for result in results if result.ok]
+    if not failed:
+        journal.finish()
+    click.secho(f"Done: {len(rendered)} rebuilt, {skipped} skipped, {resumed} resumed, {removed} removed, "
+                f"{len(failed)} failed", fg="red" if failed else "green")
+    if rendered:
+        average_ms = sum(result.elapsed_s for result in rendered) / len(rendered) * 1000
+        click.echo(f"Average render time per badge with '{rasterizer}': {average_ms:.0f}ms")
+    for result in failed:
+        click.secho(f"\n{result.user_id} ({result.full_name}):\n{result.error}", fg="red")
+    if failed:
+        click.secho("\nRun again with --resume to retry only the badges that are not done", fg="yellow")
+
+    if profile:
+        report = StageReport.from_results(results, extra=stop_recording())
+        click.echo(f"\n{report.format()}")
+        if trace_path:
+            report.write_chrome_trace(trace_path)
+            click.echo(f"Wrote trace to {trace_path}")
+    return results
+
+
+@click.option("--user", "-u", multiple=True, help="Only these users (default is everyone)")
+@click.option("--crew", multiple=True, help="Only these crews (default is everyone)")
+@click.option("--layout", type=click.Choice(LAYOUTS), default="a4", show_default=True,
+              help="One card per page, or as many cards as fit on A4 with crop marks")
+@click.option("--cards-per-document", type=click.IntRange(min=1), default=90, show_default=True)
+@click.option("--jobs", "-j", type=click.IntRange(min=1), default=1, show_default=True,
+              help="Number of documents rendered in parallel")
+@click.option("--barcode", "barcode_backend", type=click.Choice(BARCODE_BACKENDS), default="native",
+              show_default=True, help="DataMatrix encoder")
+@click.option("--face-crop/--no-face-crop", default=True, show_default=True,
+              help="Crop profile pictures around the face before embedding them")
+def pp33_sheet(
+        user: list[int],
+        crew: list[str],
+        layout: str,
+        cards_per_document: int,
+        jobs: int,
+        barcode_backend: str,
+        face_crop: bool
+):
+    import requests
+
+    from polarbadge.service.geekevents import get_client
+    from polarbadge.service.imposition import render_sheets
+
+    client = get_client()
+    config = get_config()
+
+    crew_members = _get_roster().summaries(user_ids=list(map(int, user)) or None, crews=list(crew) or None)
+
+    click.echo(f"Generating {layout} sheets for {len(crew_members)} crew members, output path "
+               f"{config.general.output_path}")
+    client.prefetch_pictures([crew.profile_image for crew in crew_members])
+
+    options = RenderOptions(
+        barcode_backend=barcode_backend,
+        face_crop=face_crop,
+        cache_path=config.general.cache_dir
+    )
+    failed = []
+
+    def iter_jobs(members: list[CrewMemberSummary]):
+        # Like generate_badges, a picture that can't be fetched leaves out that card, not the sheets
+        for crew in members:
+            try:
+                yield _build_job(crew)
+            except requests.RequestException as e:
+                click.secho(f"Could not fetch picture for {crew.full_name}: {e}", fg="red")
+                failed.append(crew)
+
+    # A document shares one stylesheet and set of layers, so every design gets its own documents
+    party = _get_party()
+    by_design: dict[str, list[CrewMemberSummary]] = {}
+    for crew in crew_members:
+        by_design.setdefault(party.select_design(crew.crew, crew.role) or DEFAULT_DESIGN, []).append(crew)
+    for name, members in by_design.items():
+        path_prefix = os.path.join(config.general.output_path, f"badges-{layout}")
+        if name != DEFAULT_DESIGN:
+            path_prefix += f"-{name}"
+        for path in render_sheets(
+                path_prefix, party.designs[name], iter_jobs(members), layout, options, cards_per_document, jobs
+        ):
+            click.secho(f"Wrote {path}", fg="blue")
+    if failed:
+        click.secho(f"Left out {len(failed)} crew members whose picture could not be fetched: "
+                    f"{', '.join(str(crew.user_id) for crew in failed)}", fg="red")
+
+
+@click.option("--user", "-u", multiple=True, required=True)
+@click.option("--raster", "rasterizer", type=click.Choice(HTML_RASTERIZERS), default="poppler", show_default=True,
+              help="HTML rasterizer to compare the pillow backend with")
+@click.option("--max-changed", type=float, default=2.0, show_default=True,
+              help="Percentage of pixels allowed to differ noticeably")
+def pp33_compare(user: list[int], rasterizer: str, max_changed: float):
+    # Renders badges with both the HTML and the pillow backend and writes what differs to
+    # <badge>-diff.png, to check that a design change looks the same on both
+    from PIL import Image
+
+    from polarbadge.service.batch import job_design, prepare_job_data
+    from polarbadge.service.geekevents import get_client
+    from polarbadge.service.raster import compare_images, render_image
+    from polarbadge.service.render import rasterize, render_card
+
+    party = _get_party()
+
+    crew_members = _get_roster().summaries(user_ids=list(map(int, user)))
+    get_client().prefetch_pictures([crew.profile_image for crew in crew_members])
+    options = RenderOptions(rasterizer=rasterizer, cache_path=get_config().general.cache_dir)
+
+    failed = 0
+    for crew in crew_members:
+        job = _build_job(crew)
+        design = job_design(party.default_design, party.designs, job)
+        data = prepare_job_data(design, job, options)
+        started = time.perf_counter()
+        reference = rasterize(design, render_card(design=design, **data), rasterizer)
+        html_ms = (time.perf_counter() - started) * 1000
+        started = time.perf_counter()
+        image = render_image(design, **data)
+        pillow_ms = (time.perf_counter() - started) * 1000
+
+        diff = compare_images(reference, image)
+        side_by_side = Image.new("RGB", (reference.width * 3, reference.height))
+        for i, part in enumerate((reference, image, diff.image)):
+            side_by_side.paste(part, (reference.width * i, 0))
+        side_by_side.save(job.file_path + "-diff.png")
+
+        ok = diff.changed * 100 <= max_changed
+        failed += not ok
+        click.secho(f"{crew.full_name}: {diff.changed * 100:.2f}% changed, mean difference {diff.mean:.2f} "
+                    f"({rasterizer} {html_ms:.0f}ms, pillow {pillow_ms:.0f}ms)", fg="green" if ok else "red")
+    if failed:
+        raise click.ClickException(f"{failed} badges differ more than {max_changed}%")
+
+
+@click.option("--listen", default="tcp:127.0.0.1:8733", show_default=True, help="tcp:HOST:PORT or unix:PATH")
+@click.option("--workers", "-j", type=click.IntRange(min=1), default=2, show_default=True,
+              help="Warm worker processes, also the number of badges rendered at once")
+@click.option("--max-queue", type=int, default=16, show_default=True,
+              help="Requests that may wait for a worker, more are turned away with 503")
+@click.option("--sync-interval", type=int, default=300, show_default=True,
+              help="Seconds between crew roster syncs, 0 to only use the local roster")
+@render_options
+@_STREAM_OPTION
+def pp33_serve(
+        listen: str,
+        workers: int,
+        max_queue: int,
+        sync_interval: int,
+        stream: str | None,
+        **render_options
+):
+    # Reprint service for the registration desk: POST /badges/<user id> renders one badge with
+    # workers that are already warm, instead of starting a whole run for it
+    import requests
+
+    from polarbadge.service.geekevents import get_client
+    from polarbadge.service.server import RenderService, make_server
+
+    party = _get_party()
+    options = RenderOptions(cache_path=get_config().general.cache_dir, **render_options)
+
+    def open_lookup():
+        # Runs in the service's dispatcher thread, which owns the roster from here on
+        roster = _get_roster(offline=not sync_interval)
+        last_sync = time.monotonic()
+
+        def sync() -> None:
+            nonlocal last_sync
+            last_sync = time.monotonic()
+            try:
+                roster.sync(get_client())
+            except requests.RequestException as e:
+                click.secho(f"Could not sync the crew roster: {e}", fg="yellow")
+
+        def lookup(user_id: int) -> BadgeJob | None:
+            if sync_interval and time.monotonic() - last_sync > sync_interval:
+                sync()
+            crew_members = roster.summaries(user_ids=[user_id])
+            # Could have joined the crew since the last sync, but don't hammer GeekEvents for typos
+            if not crew_members and sync_interval and time.monotonic() - last_sync > 30:
+                sync()
+                crew_members = roster.summaries(user_ids=[user_id])
+            return _build_job(crew_members[0]) if crew_members else None
+
+        return lookup
+
+    service = RenderService(
+        party.default_design,
+        options,
+        open_lookup,
+        workers=workers,
+        max_queue=max_queue,
+        sink=_open_sink(stream) if stream else None,
+        designs=party.designs
+    )
+    click.echo(f"Starting {workers} workers...")
+    started = time.perf_counter()
+    service.start()
+    server = make_server(listen, service, log=click.echo)
+    click.secho(f"Ready in {time.perf_counter() - started:.1f}s, listening on {listen}", fg="green")
+
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+
+    # Stopped like Ctrl-C when run as a service
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.stop()
 
 
 @click.option("--users-file", help="File we'll put the registered data into", default="./users.csv")
-def register(users_file: str):
-    crew_list = _client.get_crew_members()
-    crew_map = {crew_member.user_id: crew_member for crew_member in crew_list.members}
+@click.option("--offline", is_flag=True, help="Use the local crew roster without syncing it first")
+@click.option("--export", "export_path", metavar="PATH", default=None,
+              help="Write the current card of every registered member to a CSV file with a header, and exit")
+def register(users_file: str, offline: bool, export_path: str | None):
+    # Several desks can register into the same users file at once, see RegistrationStore
+    from polarbadge.service.registration import (
+        AlreadyRegistered, CardInUse, MemberHasCard, Registration, RegistrationStore
+    )
 
-    _continue = True
-    while _continue:
-        member_id = click.prompt("GE User ID (write 'exit' if you're done)", type=str)
-        if member_id == "exit":
-            _continue = False
-            return
+    store = RegistrationStore(users_file)
+    if export_path:
+        count = store.export_csv(export_path)
+        store.close()
+        click.secho(f"Exported {count} registrations to {export_path}", fg="green")
+        return
 
-        try:
-            user = crew_map.get(int(member_id))
-        except ValueError:
-            click.secho(f"Invalid user ID", fg="red")
-            continue
+    roster = _get_roster(offline=offline)
+    click.echo(f"{len(store)} members are registered already")
 
-        if user is None:
-            click.secho(f"User {member_id } not found, try again", fg="red")
-            continue
+    try:
+        _continue = True
+        while _continue:
+            member_id = click.prompt("GE User ID (write 'exit' if you're done)", type=str)
+            if member_id == "exit":
+                _continue = False
+                return
 
-        click.secho(f"Found user {user.username} ({user.full_name})", fg="blue")
-        try:
-            nfc_id = click.prompt("NFC ID (scan card)", type=str)
-        except ValueError:
-            click.secho("Invalid NFC ID", fg="red")
-            continue
-
-        with open(users_file, mode="a") as f:
-            line = [member_id, nfc_id, user.username, user.full_name, user.crew]
-            line_formatted = ",".join(map(str, line))
-            f.write(line_formatted + "\n")
-            click.secho(f"Saved user: {line_formatted}", fg="green")
\ No newline at end of file
+            try:
+                user = roster.get(int(member_id))
+            except ValueError:
+                click.secho(f"Invalid user ID", fg="red")
+                continue
+
+            if user is None:
+                click.secho(f"User {member_id } not found, try again", fg="red")
+                continue
+
+            click.secho(f"Found user {user.username} ({user.full_name})", fg="blue")
+            store.refresh()
+            if existing := store.get_by_member(user.user_id):
+                click.secho(f"Already registered with card {existing.nfc_id}", fg="yellow")
+            try:
+                nfc_id = click.prompt("NFC ID (scan card)", type=str)
+            except ValueError:
+                click.secho("Invalid NFC ID", fg="red")
+                continue
+
+            registration = Registration(user.user_id, nfc_id, user.username, user.full_name, user.crew)
+            try:
+                try:
+                    registration = store.add(registration)
+                except MemberHasCard as e:
+                    if not click.confirm(f"{e}, replace it with this card?"):
+                        continue
+                    registration = store.add(registration, replace=True)
+            except AlreadyRegistered as e:
+                click.secho(str(e), fg="yellow")
+                continue
+            except CardInUse as e:
+                click.secho(f"{e}, scan another card", fg="red")
+                continue
+            click.secho(f"Saved user: {','.join(map(str, registration))}", fg="green")
+    finally:
+        store.close()
@@ -0,0 +1,52 @@
+import math
+from base64 import b64encode
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from polarbadge.models.badge import BARCODE_BACKENDS
+from polarbadge.service.datamatrix import encode
+
+# Quiet zone around the native symbol, in modules
+QUIET_ZONE = 2
+
+
+def _datamatrix_native(payload: str, size_px: int) -> Image.Image:
+    matrix = encode(payload)
+    modules = len(matrix) + 2 * QUIET_ZONE
+    image = Image.new("1", (modules, modules), 1)
+    pixels = image.load()
+    for y, row in enumerate(matrix):
+        for x, dark in enumerate(row):
+            if dark:
+                pixels[x + QUIET_ZONE, y + QUIET_ZONE] = 0
+    # Whole pixels per module keeps the edges sharp, the browser scales the rest
+    scale = max(1, math.ceil(size_px / modules))
+    return image.resize((modules * scale, modules * scale), Image.NEAREST)
+
+
+def _datamatrix_treepoem(payload: str, size_px: int) -> Image.Image:
+    # Reference backend, runs BWIPP through Ghostscript
+    from treepoem import generate_barcode
+    image = generate_barcode("datamatrix", payload, scale=4)
+    return ImageOps.expand(image, border=10, fill="white")
+
+
+_BACKEND_FUNCTIONS = {
+    "native": _datamatrix_native,
+    "treepoem": _datamatrix_treepoem,
+}
+
+
+def render_datamatrix(payload: str, size_px: int, backend: str = "native") -> Image.Image:
+    if backend not in _BACKEND_FUNCTIONS:
+        raise ValueError(f"Unknown barcode backend '{backend}', must be one of {', '.join(BARCODE_BACKENDS)}")
+    return _BACKEND_FUNCTIONS[backend](payload, size_px)
+
+
+@lru_cache(maxsize=4096)
+def get_datamatrix_b64(payload: str, size_px: int, backend: str = "native") -> str:
+    buffer = BytesIO()
+    render_datamatrix(payload, size_px, backend).save(buffer, format="PNG", optimize=True)
+    return b64encode(buffer.getvalue()).decode("utf-8")
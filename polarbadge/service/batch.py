@@ -0,0 +1,232 @@
+import multiprocessing
+import os
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Iterable, Iterator
+
+from polarbadge.models.badge import BadgeJob, BadgeResult, RenderOptions
+from polarbadge.models.card import Design
+from polarbadge.service.memory import limit_memory, release_memory
+from polarbadge.service.output import write_output
+from polarbadge.service.picture import normalize_picture
+from polarbadge.service.profiling import collect, stage
+from polarbadge.service.render import rasterize, render_card
+
+# Named designs of a batch, which jobs pick through BadgeJob.design
+Designs = dict[str, Design]
+
+
+def job_design(design: Design, designs: Designs | None, job: BadgeJob) -> Design:
+    if job.design is None:
+        return design
+    if not designs or job.design not in designs:
+        raise KeyError(f"Badge for {job.full_name} asks for unknown design '{job.design}'")
+    return designs[job.design]
+
+
+def prepare_job_data(design: Design, job: BadgeJob, options: RenderOptions) -> dict:
+    data = dict(job.data)
+    if data.get("profile_picture_content"):
+        with stage("normalize_picture") as span:
+            data["profile_picture_content"] = normalize_picture(
+                data["profile_picture_content"],
+                design,
+                face_crop=options.face_crop,
+                cache_path=options.cache_path
+            )
+            span.add_bytes(len(data["profile_picture_content"]))
+    return data
+
+
+def render_badge(design: Design, job: BadgeJob, options: RenderOptions) -> BadgeResult:
+    result = BadgeResult(user_id=job.user_id, full_name=job.full_name, file_path=job.file_path)
+    started = time.perf_counter()
+    # Spans are collected per badge and travel back with the result, also from worker processes
+    with collect(options.profile) as spans, stage("badge"):
+        try:
+            data = prepare_job_data(design, job, options)
+            if options.rasterizer == "pillow":
+                # Drawn straight from the design, there is no HTML to keep
+                from polarbadge.service.raster import render_image
+                image = render_image(design, barcode_backend=options.barcode_backend, **data)
+            else:
+                html = render_card(design=design, barcode_backend=options.barcode_backend, **data)
+                with open(job.file_path + ".html", "w") as f:
+                    f.write(html)
+                result.files.append(job.file_path + ".html")
+
+                image = rasterize(design, html, rasterizer=options.rasterizer)
+                # The document embeds the layers and the picture as base64, and isn't needed for
+                # writing the image out
+                del html
+            result.files.extend(write_output(job.file_path, design, image, options))
+            image.close()
+        except Exception:
+            result.error = traceback.format_exc()
+    if options.memory_bounded:
+        release_memory()
+    for span in spans:
+        span.args["user_id"] = job.user_id
+    result.spans = spans
+    result.elapsed_s = time.perf_counter() - started
+    return result
+
+
+# The designs of the batch a worker process renders, see init_worker
+_worker_design: Design | None = None
+_worker_designs: Designs | None = None
+
+
+def init_worker(
+        design: Design,
+        warm_options: RenderOptions | None = None,
+        max_memory_mb: int | None = None,
+        designs: Designs | None = None
+) -> None:
+    # The designs are sent once per worker instead of with every job. Unpickled per job, they would
+    # be new objects every time and miss everything cached for them (compiled CSS, card skeleton).
+    global _worker_design, _worker_designs
+    if max_memory_mb:
+        limit_memory(max_memory_mb)
+    _worker_design = design
+    _worker_designs = designs
+    if warm_options:
+        warm_up(design, warm_options)
+        for other in (designs or {}).values():
+            if other is not design:
+                warm_up(other, warm_options)
+
+
+def worker_pool(
+        workers: int,
+        options: RenderOptions,
+        initializer: Callable[..., None],
+        initargs: tuple
+) -> ProcessPoolExecutor:
+    # Workers of a memory-bounded run are started by a fork server that has only imported the
+    # renderer, instead of forking this process at whatever size it has grown to by then
+    if not options.memory_bounded:
+        return ProcessPoolExecutor(max_workers=workers, initializer=initializer, initargs=initargs)
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload([__name__])
+    else:
+        context = multiprocessing.get_context("spawn")
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=context,
+        max_tasks_per_child=options.badges_per_worker,
+        initializer=initializer,
+        initargs=initargs
+    )
+
+
+def warm_up(design: Design, options: RenderOptions) -> None:
+    # Renders a throwaway badge, so imports, fonts, the template, the layers and the face detector
+    # are loaded before the first real badge arrives
+    from io import BytesIO
+    from tempfile import TemporaryDirectory
+
+    from PIL import Image as PImage
+
+    picture = BytesIO()
+    PImage.new("RGB", (64, 64), "grey").save(picture, format="JPEG")
+    with TemporaryDirectory(prefix="polarbadge-warm-") as path:
+        job = BadgeJob(user_id=1, full_name="Warm Up", file_path=os.path.join(path, "warm-up"), data={
+            "nick": "warm-up", "name": "Warm Up", "crew": "Crew", "user_id": 1,
+            "profile_picture_content": picture.getvalue(),
+        })
+        # Not memoized, the picture cache is for real pictures
+        render_badge(design, job, options.model_copy(update={"cache_path": None, "profile": False}))
+
+
+def worker_design() -> Design:
+    # The design this worker process was started with, see init_worker
+    return _worker_design
+
+
+def render_in_worker(job: BadgeJob, options: RenderOptions) -> BadgeResult:
+    return render_badge(job_design(_worker_design, _worker_designs, job), job, options)
+
+
+def iter_batch(
+        design: Design,
+        jobs: Iterable[BadgeJob],
+        workers: int = 1,
+        options: RenderOptions | None = None,
+        max_pending: int | None = None,
+        designs: Designs | None = None
+) -> Iterator[tuple[int, BadgeResult]]:
+    # Yields (job index, result) in job order as soon as each badge is done. A failing badge is
+    # reported in its result instead of aborting the whole batch. Jobs naming a design get it from
+    # designs, the others are rendered with design.
+    # Jobs are only pulled from the iterable while fewer than max_pending badges are in flight,
+    # so a slow consumer holds back rendering instead of letting finished badges pile up.
+    options = options or RenderOptions()
+
+    # A memory-bounded run renders in a worker process even with one worker, so the limit and the
+    # recycling apply to it and not to this process
+    if workers <= 1 and not options.memory_bounded:
+        for i, job in enumerate(jobs):
+            yield i, render_badge(job_design(design, designs, job), job, options)
+        return
+
+    workers = max(1, workers)
+    max_pending = max_pending or workers * 2
+    initargs = (design, None, options.max_memory_mb, designs)
+    numbered_jobs = enumerate(jobs)
+    while True:
+        # A worker that dies (killed for memory, crashed in a native library, or failed to start)
+        # breaks the pool and every badge in flight with it. Those fail, and the rest of the jobs
+        # go to a new pool, unless this one didn't get a single badge done.
+        rendered = 0
+        broken = False
+        with worker_pool(workers, options, init_worker, initargs) as executor:
+            pending: deque[tuple[int, BadgeJob, Future]] = deque()
+            for i, job in numbered_jobs:
+                pending.append((i, job, _submit(executor, job, options)))
+                if len(pending) >= max_pending:
+                    j, result = _finish(*pending.popleft())
+                    broken = broken or result.error == _BROKEN_POOL
+                    rendered += result.error != _BROKEN_POOL
+                    yield j, result
+                    if broken:
+                        break
+            while pending:
+                j, result = _finish(*pending.popleft())
+                broken = broken or result.error == _BROKEN_POOL
+                rendered += result.error != _BROKEN_POOL
+                yield j, result
+        if not broken:
+            return
+        if not rendered:
+            for i, job in numbered_jobs:
+                yield i, _failed(job, _BROKEN_POOL)
+            return
+
+
+_BROKEN_POOL = "A worker process died or could not start, see the log"
+
+
+def _failed(job: BadgeJob, error: str) -> BadgeResult:
+    return BadgeResult(user_id=job.user_id, full_name=job.full_name, file_path=job.file_path, error=error)
+
+
+def _submit(executor: ProcessPoolExecutor, job: BadgeJob, options: RenderOptions) -> Future:
+    try:
+        return executor.submit(render_in_worker, job, options)
+    except BrokenProcessPool as e:
+        future = Future()
+        future.set_exception(e)
+        return future
+
+
+def _finish(i: int, job: BadgeJob, future: Future) -> tuple[int, BadgeResult]:
+    try:
+        return i, future.result()
+    except BrokenProcessPool:
+        return i, _failed(job, _BROKEN_POOL)
+
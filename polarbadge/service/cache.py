@@ -0,0 +1,67 @@
+import hashlib
+import json
+import os
+from typing import NamedTuple
+
+
+class CachedResponse(NamedTuple):
+    content: bytes
+    etag: str | None
+    last_modified: str | None
+
+
+def _write_atomic(path: str, content: bytes) -> None:
+    # Write to a temp file and rename, so concurrent writers never leave a half-written entry
+    tmp_path = f"{path}.{os.getpid()}-{id(content)}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class BlobCache:
+    # Disk cache for derived data, keyed by a string the caller builds from the inputs
+    def __init__(self, path: str):
+        self._path = path
+        os.makedirs(self._path, exist_ok=True)
+
+    def _key_path(self, key: str) -> str:
+        return os.path.join(self._path, hashlib.sha256(key.encode("utf-8")).hexdigest())
+
+    def get(self, key: str) -> bytes | None:
+        try:
+            with open(self._key_path(key), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key: str, content: bytes) -> None:
+        _write_atomic(self._key_path(key), content)
+
+
+class PictureCache:
+    # Disk cache for downloaded pictures, keyed by URL. The validators (ETag/Last-Modified) are
+    # stored next to the content so the server can tell us if our copy is still good.
+    def __init__(self, path: str):
+        self._path = path
+        os.makedirs(self._path, exist_ok=True)
+
+    def _key_path(self, url: str) -> str:
+        key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        return os.path.join(self._path, key)
+
+    def get(self, url: str) -> CachedResponse | None:
+        key_path = self._key_path(url)
+        try:
+            with open(key_path + ".json", "r") as f:
+                meta = json.load(f)
+            with open(key_path + ".bin", "rb") as f:
+                content = f.read()
+        except (OSError, ValueError):
+            return None
+        return CachedResponse(content=content, etag=meta.get("etag"), last_modified=meta.get("last_modified"))
+
+    def set(self, url: str, content: bytes, etag: str | None = None, last_modified: str | None = None) -> None:
+        key_path = self._key_path(url)
+        meta = {"url": url, "etag": etag, "last_modified": last_modified}
+        _write_atomic(key_path + ".bin", content)
+        _write_atomic(key_path + ".json", json.dumps(meta).encode("utf-8"))
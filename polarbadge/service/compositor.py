@@ -0,0 +1,173 @@
+# Layer compositing for the native raster backend. Every badge of a design has the same
+# background and foreground, and only the profile picture between them differs:
+#
+#   z1    background colour and background_png
+#   z50   profile picture (ImageBox)
+#   z100  foreground_png
+#   z200  text (TextBox) and barcode (Code2DBox), drawn on the composited card
+#
+# The layers are decoded once per design into a base card with everything but the picture. Each
+# badge starts from a copy of the base and only the picture box is blended again, from the layers
+# kept around for it. Within that box, pixels covered by an opaque foreground look the same for
+# every badge, so only the bounding box of the see-through pixels (the window) is blended.
+# Pictures of many badges can be blended in one go as an (N, height, width) array.
+from typing import NamedTuple, Sequence
+
+import numpy as np
+from PIL import Image as PImage
+
+from polarbadge.models.card import Design
+
+
+class Box(NamedTuple):
+    left: int
+    top: int
+    right: int
+    bottom: int
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.right - self.left, self.bottom - self.top
+
+
+def _layer(path: str, size: tuple[int, int]) -> np.ndarray:
+    with PImage.open(path) as image:
+        image = image.convert("RGBA")
+    if image.size != size:
+        image = image.resize(size, PImage.LANCZOS)
+    return np.asarray(image)
+
+
+def _over(dst: np.ndarray, src: np.ndarray) -> np.ndarray:
+    # src (RGBA) over an opaque dst (RGB), rounded to nearest, for the layers of the base
+    alpha = src[..., 3:].astype(np.uint16)
+    blended = src[..., :3] * alpha + dst * (255 - alpha) + 127
+    return (blended // 255).astype(np.uint8)
+
+
+def _planar(image: np.ndarray) -> np.ndarray:
+    # Channels first. Blending one plane against the alpha plane keeps numpy in contiguous loops,
+    # broadcasting alpha over interleaved RGB is about ten times slower.
+    return np.ascontiguousarray(np.moveaxis(image, -1, -3))
+
+
+def _divide_255(values: np.ndarray) -> np.ndarray:
+    # Rounded division by 255 of uint16 products, in place, exact for values up to 255 * 255 + 255
+    values += 128
+    values += values >> 8
+    values >>= 8
+    return values
+
+
+class Compositor:
+    def __init__(self, design: Design):
+        self.design = design
+        size = (design.width_px, design.height_px)
+        mm = design.mm_to_px
+        color = PImage.new("RGB", (1, 1), f"#{design.background_color}").getpixel((0, 0))
+        under = np.empty((size[1], size[0], 3), dtype=np.uint8)
+        under[:] = color
+        if design.background_png:
+            under = _over(under, _layer(design.background_png.path, size))
+        foreground = _layer(design.foreground_png.path, size) if design.foreground_png else None
+
+        # The card without a picture, copied for every badge
+        base = _over(under, foreground) if foreground is not None else under
+        self.base = PImage.fromarray(base, "RGB")
+
+        box = design.image_profile
+        left, top = mm(box.anchor_x_mm), mm(box.anchor_y_mm)
+        self.picture_box = Box(left, top, left + mm(box.width_mm), top + mm(box.height_mm))
+        self.scaling = box.scaling
+        # The part of the picture box the picture can be seen through, clipped to the card
+        window = Box(max(0, left), max(0, top),
+                     min(size[0], self.picture_box.right), min(size[1], self.picture_box.bottom))
+        if foreground is not None and window.right > window.left and window.bottom > window.top:
+            see_through = foreground[window.top:window.bottom, window.left:window.right, 3] < 255
+            rows, columns = np.nonzero(see_through.any(axis=1))[0], np.nonzero(see_through.any(axis=0))[0]
+            if len(rows):
+                window = Box(window.left + int(columns[0]), window.top + int(rows[0]),
+                             window.left + int(columns[-1]) + 1, window.top + int(rows[-1]) + 1)
+            else:
+                window = Box(window.left, window.top, window.left, window.top)
+        self.window = window
+
+        # Layers within the window, planar and in the integer type the blend works in. The
+        # foreground is only blended again where it covers part of the picture.
+        crop = (slice(window.top, window.bottom), slice(window.left, window.right))
+        self._under = _planar(under[crop]).astype(np.uint16)
+        self._covered = (np.empty(0, dtype=np.intp), np.empty(0, dtype=np.intp))
+        if foreground is not None:
+            alpha = foreground[crop][..., 3]
+            self._covered = np.nonzero(alpha > 0)
+            alpha = alpha[self._covered].astype(np.uint16)
+            self._foreground = _planar(foreground[crop][..., :3])[:, self._covered[0], self._covered[1]] * alpha
+            self._foreground_inverse = 255 - alpha
+
+    @property
+    def has_window(self) -> bool:
+        return self.window.right > self.window.left and self.window.bottom > self.window.top
+
+    def fit_picture(self, picture: PImage.Image) -> np.ndarray:
+        # The picture scaled into the picture box like object-fit does, as planar RGBA (4, height,
+        # width) of the window. cover fills the box and crops the overflow, contain leaves the rest
+        # of the box transparent.
+        width, height = self.picture_box.size
+        picture = picture.convert("RGBA")
+        scale = (max if self.scaling == "cover" else min)(width / picture.width, height / picture.height)
+        scaled = picture.resize(
+            (max(1, round(picture.width * scale)), max(1, round(picture.height * scale))),
+            PImage.LANCZOS
+        )
+        # Position of the scaled picture relative to the window
+        left = self.picture_box.left + (width - scaled.width) // 2 - self.window.left
+        top = self.picture_box.top + (height - scaled.height) // 2 - self.window.top
+        layer = PImage.new("RGBA", self.window.size, (0, 0, 0, 0))
+        layer.paste(scaled, (left, top))
+        return np.stack([np.asarray(band) for band in layer.split()])
+
+    def blend(self, pictures: np.ndarray) -> np.ndarray:
+        # (N, 4, height, width) fitted pictures to (N, 3, height, width) finished windows
+        alpha = pictures[:, 3:]
+        if alpha.min() == 255:
+            # Opaque pictures hide the background, the usual case for cover
+            windows = pictures[:, :3].astype(np.uint16)
+        else:
+            alpha = alpha.astype(np.uint16)
+            windows = pictures[:, :3] * alpha
+            windows += self._under * (255 - alpha)
+            _divide_255(windows)
+        rows, columns = self._covered
+        if len(rows):
+            covered = windows[..., rows, columns]
+            covered *= self._foreground_inverse
+            covered += self._foreground
+            windows[..., rows, columns] = _divide_255(covered)
+        return windows.astype(np.uint8)
+
+    def compose(self, pictures: Sequence[PImage.Image | None], chunk: int = 8) -> list[PImage.Image]:
+        # One card per picture, with the picture behind the foreground, ready for text and barcode.
+        # Pictures are blended a chunk at a time, larger batches no longer fit in the CPU caches.
+        cards = [self.base.copy() for _ in pictures]
+        if not self.has_window:
+            return cards
+        with_picture = [index for index, picture in enumerate(pictures) if picture is not None]
+        for start in range(0, len(with_picture), chunk):
+            indexes = with_picture[start:start + chunk]
+            windows = self.blend(np.stack([self.fit_picture(pictures[index]) for index in indexes]))
+            for index, window in zip(indexes, windows):
+                planes = [PImage.fromarray(plane) for plane in window]
+                cards[index].paste(PImage.merge("RGB", planes), self.window[:2])
+        return cards
+
+
+_compositors: dict[int, Compositor] = {}
+
+
+def get_compositor(design: Design) -> Compositor:
+    # Same caching as compile_design, the layers are decoded once per design and process
+    compositor = _compositors.get(id(design))
+    if compositor is None or compositor.design is not design:
+        compositor = Compositor(design)
+        _compositors[id(design)] = compositor
+    return compositor
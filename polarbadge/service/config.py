@@ -1,5 +1,6 @@
 import os
 import tomllib
+from functools import cache
 
 from pydantic import BaseModel, Field
 from polarbadge.models.geekevents import GEConfig
@@ -9,6 +10,11 @@ _CONFIG_PATH = os.path.join(_base_path, "config.toml")
 
 class GeneralConfig(BaseModel):
     output_path: str | None = None
+    cache_path: str | None = None
+
+    @property
+    def cache_dir(self) -> str:
+        return self.cache_path or os.path.join(os.path.expanduser("~"), ".cache", "polarbadge")
 
 
 class Config(BaseModel):
@@ -16,7 +22,9 @@ class Config(BaseModel):
     general: GeneralConfig
 
 
+@cache
 def get_config():
-    with open(_CONFIG_PATH, 'rb') as f:
+    # POLARBADGE_CONFIG points to another config file, e.g. for benchmarks
+    with open(os.environ.get("POLARBADGE_CONFIG", _CONFIG_PATH), 'rb') as f:
         data = tomllib.load(f)
     return Config.model_validate(data)
\ No newline at end of file
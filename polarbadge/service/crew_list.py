@@ -0,0 +1,90 @@
+# Streaming parser for the GeekEvents crew list, a JSON object of {user id: crew member}. The
+# members are decoded one at a time from the response chunks, so the whole document never has
+# to be in memory.
+import codecs
+import json
+import re
+from typing import Iterable, Iterator
+
+_WHITESPACE = re.compile(r"\s*")
+_DECODER = json.JSONDecoder()
+
+
+class _ChunkReader:
+    def __init__(self, chunks: Iterable[bytes]):
+        self._chunks = iter(chunks)
+        self._text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self) -> bool:
+        # Appends the next chunk, dropping what has been consumed. False at the end of the input.
+        if self._eof:
+            return False
+        chunk = next(self._chunks, None)
+        if chunk is None:
+            self._eof = True
+            text = self._text_decoder.decode(b"", final=True)
+        else:
+            text = self._text_decoder.decode(chunk)
+        self._buffer = self._buffer[self._pos:] + text
+        self._pos = 0
+        return True
+
+    def _skip_whitespace(self) -> None:
+        while True:
+            self._pos = _WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer) or not self._fill():
+                return
+
+    def next_char(self) -> str:
+        self._skip_whitespace()
+        char = self._buffer[self._pos:self._pos + 1]
+        if not char:
+            raise ValueError("Unexpected end of the crew list")
+        self._pos += 1
+        return char
+
+    def expect(self, char: str) -> None:
+        found = self.next_char()
+        if found != char:
+            raise ValueError(f"Expected '{char}' in the crew list, found '{found}'")
+
+    def peek(self) -> str:
+        self._skip_whitespace()
+        return self._buffer[self._pos:self._pos + 1]
+
+    def value(self):
+        self._skip_whitespace()
+        while True:
+            try:
+                value, end = _DECODER.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError:
+                # Most likely the value continues in the next chunk
+                if not self._fill():
+                    raise
+                continue
+            # A number or literal ending exactly at the end of the buffer might not be complete
+            if end == len(self._buffer) and not isinstance(value, (dict, list, str)) and self._fill():
+                continue
+            self._pos = end
+            return value
+
+
+def iter_crew_items(chunks: Iterable[bytes]) -> Iterator[dict]:
+    # Yields the raw crew member objects in document order
+    reader = _ChunkReader(chunks)
+    reader.expect("{")
+    if reader.peek() == "}":
+        return
+    while True:
+        reader.value()
+        reader.expect(":")
+        yield reader.value()
+        separator = reader.next_char()
+        if separator == "}":
+            return
+        if separator != ",":
+            raise ValueError(f"Expected ',' or '}}' in the crew list, found '{separator}'")
+
@@ -0,0 +1,235 @@
+# Pure Python ECC 200 DataMatrix encoder (ISO/IEC 16022), limited to square symbols and ASCII
+# encodation. That covers everything we put on a badge (user IDs), without starting Ghostscript.
+from typing import NamedTuple
+
+
+class SymbolSize(NamedTuple):
+    size: int
+    region_size: int
+    regions: int  # per side
+    data_codewords: int
+    ecc_codewords: int
+    blocks: int
+
+
+SYMBOL_SIZES = [
+    SymbolSize(10, 8, 1, 3, 5, 1),
+    SymbolSize(12, 10, 1, 5, 7, 1),
+    SymbolSize(14, 12, 1, 8, 10, 1),
+    SymbolSize(16, 14, 1, 12, 12, 1),
+    SymbolSize(18, 16, 1, 18, 14, 1),
+    SymbolSize(20, 18, 1, 22, 18, 1),
+    SymbolSize(22, 20, 1, 30, 20, 1),
+    SymbolSize(24, 22, 1, 36, 24, 1),
+    SymbolSize(26, 24, 1, 44, 28, 1),
+    SymbolSize(32, 14, 2, 62, 36, 1),
+    SymbolSize(36, 16, 2, 86, 42, 1),
+    SymbolSize(40, 18, 2, 114, 48, 1),
+    SymbolSize(44, 20, 2, 144, 56, 1),
+    SymbolSize(48, 22, 2, 174, 68, 1),
+    SymbolSize(52, 24, 2, 204, 84, 2),
+]
+
+Matrix = list[list[bool]]
+
+# GF(256) with the DataMatrix prime polynomial x^8 + x^5 + x^3 + x^2 + 1
+_GF_EXP = [0] * 512
+_GF_LOG = [0] * 256
+_value = 1
+for _i in range(255):
+    _GF_EXP[_i] = _value
+    _GF_LOG[_value] = _i
+    _value <<= 1
+    if _value & 0x100:
+        _value ^= 0x12D
+for _i in range(255, 512):
+    _GF_EXP[_i] = _GF_EXP[_i - 255]
+
+_generators: dict[int, list[int]] = {}
+
+
+def _gf_mul(a: int, b: int) -> int:
+    if a == 0 or b == 0:
+        return 0
+    return _GF_EXP[_GF_LOG[a] + _GF_LOG[b]]
+
+
+def _generator(degree: int) -> list[int]:
+    # Coefficients of prod(x + a^i) for i in 1..degree, highest power first, leading 1 dropped
+    if degree not in _generators:
+        poly = [1]
+        for i in range(1, degree + 1):
+            factor = _GF_EXP[i]
+            poly = [a ^ _gf_mul(b, factor) for a, b in zip(poly + [0], [0] + poly)]
+        _generators[degree] = poly[1:]
+    return _generators[degree]
+
+
+def _reed_solomon(data: list[int], ecc_length: int) -> list[int]:
+    generator = _generator(ecc_length)
+    ecc = [0] * ecc_length
+    for codeword in data:
+        factor = codeword ^ ecc[0]
+        ecc = ecc[1:] + [0]
+        for i in range(ecc_length):
+            ecc[i] ^= _gf_mul(generator[i], factor)
+    return ecc
+
+
+def _encode_ascii(data: bytes) -> list[int]:
+    codewords = []
+    i = 0
+    while i < len(data):
+        char = data[i]
+        if 48 <= char <= 57 and i + 1 < len(data) and 48 <= data[i + 1] <= 57:
+            codewords.append(130 + (char - 48) * 10 + (data[i + 1] - 48))
+            i += 2
+            continue
+        if char > 127:
+            # Upper shift
+            codewords.append(235)
+            char -= 128
+        codewords.append(char + 1)
+        i += 1
+    return codewords
+
+
+def _pad(codewords: list[int], capacity: int) -> list[int]:
+    padded = list(codewords)
+    if len(padded) < capacity:
+        padded.append(129)
+    while len(padded) < capacity:
+        # 253-state randomising of the remaining pad characters
+        position = len(padded) + 1
+        pad = 129 + ((149 * position) % 253) + 1
+        padded.append(pad - 254 if pad > 254 else pad)
+    return padded
+
+
+def _add_error_correction(data: list[int], symbol: SymbolSize) -> list[int]:
+    ecc_per_block = symbol.ecc_codewords // symbol.blocks
+    codewords = data + [0] * symbol.ecc_codewords
+    for block in range(symbol.blocks):
+        block_data = data[block::symbol.blocks]
+        for i, codeword in enumerate(_reed_solomon(block_data, ecc_per_block)):
+            codewords[len(data) + block + i * symbol.blocks] = codeword
+    return codewords
+
+
+def _place(codewords: list[int], nrow: int, ncol: int) -> Matrix:
+    # Module placement from ISO/IEC 16022 Annex F
+    grid: list[list[bool | None]] = [[None] * ncol for _ in range(nrow)]
+
+    def module(row: int, col: int, index: int, bit: int):
+        if row < 0:
+            row += nrow
+            col += 4 - ((nrow + 4) % 8)
+        if col < 0:
+            col += ncol
+            row += 4 - ((ncol + 4) % 8)
+        grid[row][col] = bool((codewords[index] >> (8 - bit)) & 1)
+
+    def utah(row: int, col: int, index: int):
+        module(row - 2, col - 2, index, 1)
+        module(row - 2, col - 1, index, 2)
+        module(row - 1, col - 2, index, 3)
+        module(row - 1, col - 1, index, 4)
+        module(row - 1, col, index, 5)
+        module(row, col - 2, index, 6)
+        module(row, col - 1, index, 7)
+        module(row, col, index, 8)
+
+    def corner(positions: list[tuple[int, int]], index: int):
+        for bit, (row, col) in enumerate(positions, start=1):
+            module(row, col, index, bit)
+
+    corner1 = [(nrow - 1, 0), (nrow - 1, 1), (nrow - 1, 2), (0, ncol - 2),
+               (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)]
+    corner2 = [(nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 4),
+               (0, ncol - 3), (0, ncol - 2), (0, ncol - 1), (1, ncol - 1)]
+    corner3 = [(nrow - 3, 0), (nrow - 2, 0), (nrow - 1, 0), (0, ncol - 2),
+               (0, ncol - 1), (1, ncol - 1), (2, ncol - 1), (3, ncol - 1)]
+    corner4 = [(nrow - 1, 0), (nrow - 1, ncol - 1), (0, ncol - 3), (0, ncol - 2),
+               (0, ncol - 1), (1, ncol - 3), (1, ncol - 2), (1, ncol - 1)]
+
+    index = 0
+    row, col = 4, 0
+    while True:
+        if row == nrow and col == 0:
+            corner(corner1, index)
+            index += 1
+        if row == nrow - 2 and col == 0 and ncol % 4:
+            corner(corner2, index)
+            index += 1
+        if row == nrow - 2 and col == 0 and ncol % 8 == 4:
+            corner(corner3, index)
+            index += 1
+        if row == nrow + 4 and col == 2 and not ncol % 8:
+            corner(corner4, index)
+            index += 1
+
+        # Sweep upward diagonally
+        while True:
+            if row < nrow and col >= 0 and grid[row][col] is None:
+                utah(row, col, index)
+                index += 1
+            row -= 2
+            col += 2
+            if not (row >= 0 and col < ncol):
+                break
+        row += 1
+        col += 3
+
+        # Sweep downward diagonally
+        while True:
+            if row >= 0 and col < ncol and grid[row][col] is None:
+                utah(row, col, index)
+                index += 1
+            row += 2
+            col -= 2
+            if not (row < nrow and col >= 0):
+                break
+        row += 3
+        col += 1
+
+        if not (row < nrow or col < ncol):
+            break
+
+    # Unused bottom right corner gets a fixed pattern
+    if grid[nrow - 1][ncol - 1] is None:
+        grid[nrow - 1][ncol - 1] = grid[nrow - 2][ncol - 2] = True
+        grid[nrow - 1][ncol - 2] = grid[nrow - 2][ncol - 1] = False
+
+    return [[bool(value) for value in grid_row] for grid_row in grid]
+
+
+def encode(data: str | bytes) -> Matrix:
+    # Returns the symbol as rows of modules (True is dark), without the quiet zone
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+
+    codewords = _encode_ascii(data)
+    symbol = next((size for size in SYMBOL_SIZES if size.data_codewords >= len(codewords)), None)
+    if symbol is None:
+        raise ValueError(f"Data is too long for a DataMatrix symbol ({len(codewords)} codewords)")
+
+    codewords = _add_error_correction(_pad(codewords, symbol.data_codewords), symbol)
+    mapping_size = symbol.region_size * symbol.regions
+    mapping = _place(codewords, mapping_size, mapping_size)
+
+    matrix = [[False] * symbol.size for _ in range(symbol.size)]
+    step = symbol.region_size + 2
+    for y in range(symbol.size):
+        for x in range(symbol.size):
+            region_y, region_x = y % step, x % step
+            if region_x == 0 or region_y == step - 1:
+                # Solid L-shaped finder pattern
+                matrix[y][x] = True
+            elif region_y == 0:
+                # Alternating timing pattern on top and right
+                matrix[y][x] = region_x % 2 == 0
+            elif region_x == step - 1:
+                matrix[y][x] = region_y % 2 == 1
+            else:
+                matrix[y][x] = mapping[y - 2 * (y // step) - 1][x - 2 * (x // step) - 1]
+    return matrix
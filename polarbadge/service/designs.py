@@ -0,0 +1,136 @@
+# Registry of the party packages under polarbadge/parties. A party's spec module defines
+# `design`, its default design, and optionally more `designs` by name and `design_rules` that
+# pick one of them per crew member by crew or role (see polarbadge.models.card.Party).
+#
+# Importing a spec builds and validates its designs, which opens every layer. The validated party
+# is cached as JSON, keyed by the contents of the party package (spec, layers, fonts) and of the
+# models it was validated against, so later runs load it without importing the spec or opening
+# the layers again.
+import hashlib
+import importlib
+import json
+import os
+
+import polarbadge.parties
+from polarbadge.models.card import ASSETS_CHECKED, DEFAULT_DESIGN, Party
+from polarbadge.service.cache import BlobCache
+from polarbadge.service.config import get_config
+
+PARTIES_PACKAGE = "polarbadge.parties"
+
+# Bump when the cached form changes in a way the models don't reflect
+CACHE_VERSION = 1
+
+_POLARBADGE_PATH = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+# What a cached party was validated against
+_MODEL_SOURCES = (
+    os.path.join(_POLARBADGE_PATH, "models", "card.py"),
+    os.path.join(_POLARBADGE_PATH, "card", "constants.py"),
+)
+
+
+def discover_parties() -> dict[str, str]:
+    # Party name -> package directory, for every package with a spec module
+    parties = {}
+    for base_path in polarbadge.parties.__path__:
+        for name in sorted(os.listdir(base_path)):
+            path = os.path.join(base_path, name)
+            if name.isidentifier() and os.path.isfile(os.path.join(path, "spec.py")):
+                parties.setdefault(name, os.path.realpath(path))
+    return parties
+
+
+def _source_files(path: str) -> list[str]:
+    files = []
+    for root, dirs, names in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d != "__pycache__" and not d.startswith("."))
+        files.extend(os.path.join(root, name) for name in sorted(names) if not name.startswith("."))
+    return files
+
+
+def _file_hash(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _import_party(name: str) -> Party:
+    spec = importlib.import_module(f"{PARTIES_PACKAGE}.{name}.spec")
+    return Party(
+        name=name,
+        designs={DEFAULT_DESIGN: spec.design, **getattr(spec, "designs", {})},
+        rules=getattr(spec, "design_rules", [])
+    )
+
+
+class DesignRegistry:
+    # Loads each party at most once per process. Without a cache path every load imports the spec.
+    def __init__(self, cache_path: str | None = None):
+        self._cache = BlobCache(os.path.join(cache_path, "designs")) if cache_path else None
+        self._parties: dict[str, Party] = {}
+
+    def fingerprint(self, name: str) -> str:
+        # Hash over the party package and the models. Files are only read again when their size or
+        # modification time changed since the last run.
+        path = discover_parties()[name]
+        index_key = f"files:{path}"
+        index = {}
+        if self._cache and (cached := self._cache.get(index_key)):
+            index = json.loads(cached)
+
+        digest = hashlib.sha256(f"{CACHE_VERSION}\0{path}".encode("utf-8"))
+        files = {}
+        for file in (*_MODEL_SOURCES, *_source_files(path)):
+            stat = os.stat(file)
+            known = index.get(file)
+            if known and known[:2] == [stat.st_size, stat.st_mtime_ns]:
+                file_hash = known[2]
+            else:
+                file_hash = _file_hash(file)
+            files[file] = [stat.st_size, stat.st_mtime_ns, file_hash]
+            digest.update(f"\0{os.path.relpath(file, path)}\0{file_hash}".encode("utf-8"))
+
+        if self._cache and files != index:
+            self._cache.set(index_key, json.dumps(files).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, name: str) -> Party:
+        party = self._parties.get(name)
+        if party is None:
+            party = self._parties[name] = self._load(name)
+        return party
+
+    def _load(self, name: str) -> Party:
+        parties = discover_parties()
+        if name not in parties:
+            raise KeyError(f"Unknown party '{name}' (must be one of {', '.join(parties)})")
+        if self._cache is None:
+            return _import_party(name)
+
+        key = f"party:{name}:{self.fingerprint(name)}"
+        cached = self._cache.get(key)
+        if cached is not None:
+            try:
+                return Party.model_validate_json(cached, context={ASSETS_CHECKED: True})
+            except ValueError:
+                # Unreadable entry, built again below
+                pass
+        party = _import_party(name)
+        self._cache.set(key, party.model_dump_json().encode("utf-8"))
+        return party
+
+
+_registry: DesignRegistry | None = None
+
+
+def get_registry() -> DesignRegistry:
+    global _registry
+    if _registry is None:
+        _registry = DesignRegistry(get_config().general.cache_dir)
+    return _registry
+
+
+def get_party(name: str) -> Party:
+    return get_registry().get(name)
@@ -0,0 +1,58 @@
+# Fonts are loaded once per process and shared by every badge rendered in it, instead of every
+# document loading and parsing the design's font files again
+from decimal import Decimal
+from functools import cache, lru_cache
+
+from PIL import ImageFont
+
+from polarbadge.models.card import ExternalFontFamily, Font
+
+
+@cache
+def get_font_config():
+    # WeasyPrint skips @font-face rules its FontConfiguration has already loaded, but every
+    # document gets a new one (reading, copying and registering the font files with fontconfig
+    # again) unless one is passed in
+    from weasyprint.text.fonts import FontConfiguration
+    return FontConfiguration()
+
+
+def _font_path(font: Font) -> str:
+    if isinstance(font.family, ExternalFontFamily):
+        return font.family.path
+    # Pillow looks system fonts up by file name
+    return f"{font.family}.ttf"
+
+
+@lru_cache(maxsize=64)
+def _load_image_font(path: str, size_px: float, weight: int) -> ImageFont.FreeTypeFont:
+    try:
+        image_font = ImageFont.truetype(path, size_px)
+    except OSError:
+        return ImageFont.load_default(size_px)
+    try:
+        axes = image_font.get_variation_axes()
+    except OSError:
+        # Not a variable font
+        return image_font
+    # Variable fonts start out at their default instance, browsers ask for normal (400). Pillow
+    # gives the axes by name, not by tag, the weight axis (wght) is called "Weight".
+    values = [axis["default"] for axis in axes]
+    for i, axis in enumerate(axes):
+        name = axis["name"].decode("utf-8", "replace") if isinstance(axis["name"], bytes) else axis["name"]
+        if name.lower() == "weight":
+            values[i] = min(max(weight, axis["minimum"]), axis["maximum"])
+            image_font.set_variation_by_axes(values)
+            break
+    return image_font
+
+
+def get_image_font(font: Font, dpi: Decimal) -> ImageFont.FreeTypeFont:
+    # Shared instances, don't change their variation
+    return _load_image_font(_font_path(font), float(font.size_pt * dpi / 72), font.weight or 400)
+
+
+@lru_cache(maxsize=16384)
+def text_length(font: ImageFont.FreeTypeFont, text: str) -> float:
+    # Fonts from get_image_font are cached themselves, so they are stable cache keys
+    return font.getlength(text)
@@ -1,25 +1,54 @@
-from base64 import b64encode
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import requests
 from urllib.parse import urljoin
 
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.util.retry import Retry
 
 from polarbadge.models.geekevents import CrewMember, GEConfig, CrewMemberList
+from polarbadge.service.cache import PictureCache
+from polarbadge.service.crew_list import iter_crew_items
 from polarbadge.service.config import get_config
+from polarbadge.service.profiling import stage
 
-_config = get_config()
 _CLIENT = None
 
+# Size of the chunks the crew list is parsed in
+CREW_LIST_CHUNK_SIZE = 64 * 1024
+
+# Responses worth asking again for, GeekEvents behind a proxy answers 502/504 while restarting
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
 
 class GEClient:
-    def __init__(self, config: GEConfig):
+    def __init__(self, config: GEConfig, cache: PictureCache | None = None):
         self._user = config.username
         self._secret = config.secret
         self._base_url = config.base_url
         self._party_id = config.party_id
+        self._timeout = (config.connect_timeout_s, config.read_timeout_s)
         self._session = requests.Session()
         self._session.auth = HTTPBasicAuth(self._user, self._secret)
+        retry = Retry(
+            total=config.retries,
+            backoff_factor=config.backoff_s,
+            backoff_jitter=config.backoff_jitter_s,
+            status_forcelist=RETRY_STATUSES,
+            # Only what is safe to send twice, a POST might have been handled before it failed
+            allowed_methods=frozenset({"GET", "HEAD"}),
+            # The last response is returned as is, raise_for_status reports it
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_maxsize=config.pool_size, max_retries=retry)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._pool_size = config.pool_size
+        self._cache = cache
+        # URLs that have been downloaded or revalidated during this run
+        self._validated: set[str] = set()
 
     def request(
             self,
@@ -27,8 +56,11 @@ class GEClient:
             method: str = "GET",
             headers: dict | None = None,
             params: dict | None = None,
-            data: dict | None = None
+            data: dict | None = None,
+            stream: bool = False,
+            timeout: float | tuple[float, float] | None = None
     ) -> requests.Response:
+        # timeout is (connect, read) seconds, or one for both, defaulting to the configured ones
 
         _headers = headers or {}
         _headers["User-Agent"] = "polarbadge/v0"
@@ -38,6 +70,8 @@ class GEClient:
             method=method,
             url=urljoin(self._base_url, path),
             headers=_headers,
+            stream=stream,
+            timeout=timeout or self._timeout,
             # params=params,
             # data=data
         )
@@ -46,17 +80,77 @@ class GEClient:
         return response
 
 
-    def get_crew_members(self) -> CrewMemberList:
+    def get_crew_list(self, etag: str | None = None) -> requests.Response:
+        # The crew list response with its body still unread, for parsing it while it arrives with
+        # iter_crew_items. A 304 without body if it still matches the given ETag.
         path = f"/event/{self._party_id}/crew/api/crew-list/"
-        response = self.request(path).json()
-        return CrewMemberList(members=[CrewMember(**item) for item in response.values()])
+        headers = {"If-None-Match": etag} if etag else None
+        with stage("crew_list"):
+            return self.request(path, headers=headers, stream=True)
+
+    def get_crew_members(self) -> CrewMemberList:
+        with self.get_crew_list() as response:
+            items = iter_crew_items(response.iter_content(CREW_LIST_CHUNK_SIZE))
+            return CrewMemberList(members=[CrewMember(**item) for item in items])
 
     def get_picture(self, path: str) -> bytes:
-        response = self.request(path)
-        return response.content
+        # Pictures already fetched or revalidated during this run are read from the cache without
+        # a request, as a stage of their own, so "get_picture" counts every download only once
+        url = urljoin(self._base_url, path)
+        if self._cache is not None and url in self._validated:
+            with stage("picture_cache") as span:
+                cached = self._cache.get(url)
+                span.add_bytes(len(cached.content) if cached else 0)
+            if cached:
+                return cached.content
+
+        with stage("get_picture") as span:
+            content = self._get_picture(path, url)
+            span.add_bytes(len(content))
+        return content
+
+    def _get_picture(self, path: str, url: str) -> bytes:
+        if self._cache is None:
+            return self.request(path).content
+
+        cached = self._cache.get(url)
+        headers = {}
+        if cached and cached.etag:
+            headers["If-None-Match"] = cached.etag
+        if cached and cached.last_modified:
+            headers["If-Modified-Since"] = cached.last_modified
+
+        response = self.request(path, headers=headers)
+        if response.status_code == 304 and cached:
+            content = cached.content
+        else:
+            content = response.content
+            self._cache.set(url, content, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+        self._validated.add(url)
+        return content
+
+    def prefetch_pictures(self, paths: list[str], workers: int = 8) -> dict[str, Exception]:
+        # Downloads (or revalidates) all pictures into the cache concurrently, so later
+        # get_picture calls are served from disk. Returns the paths that failed.
+        if self._cache is None:
+            return {}
+
+        failures = {}
+        # Threads beyond the pool size would open connections only to throw them away again
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, self._pool_size))) as executor:
+            futures = {executor.submit(self.get_picture, path): path for path in dict.fromkeys(paths)}
+            for future in as_completed(futures):
+                if exc := future.exception():
+                    failures[futures[future]] = exc
+        return failures
 
 def get_client():
-    config = _config.geekevents
-    if not config:
-        raise Exception("No GE config")
-    return GEClient(config)
+    global _CLIENT
+    if _CLIENT is None:
+        config = get_config()
+        if not config.geekevents:
+            raise Exception("No GE config")
+        cache = PictureCache(os.path.join(config.general.cache_dir, "pictures"))
+        _CLIENT = GEClient(config.geekevents, cache=cache)
+    return _CLIENT
@@ -0,0 +1,151 @@
+from collections import deque
+from concurrent.futures import Future
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Iterable, Iterator, NamedTuple
+
+from polarbadge.models.badge import LAYOUTS, BadgeJob, RenderOptions
+from polarbadge.models.card import Design
+from polarbadge.service.batch import init_worker, prepare_job_data, worker_design, worker_pool
+from polarbadge.service.fonts import get_font_config
+from polarbadge.service.render import build_subject, compile_design, get_template
+
+A4_MM = (Decimal("210"), Decimal("297"))
+SHEET_MARGIN_MM = Decimal("10")
+# Room between cards for the crop marks
+SHEET_GAP_MM = Decimal("8")
+CROP_MARK_MM = Decimal("3")
+# Space between the card edge and its crop marks
+CROP_MARK_OFFSET_MM = Decimal("1")
+
+
+class Slot(NamedTuple):
+    x_mm: Decimal
+    y_mm: Decimal
+    subject: dict[str, Any]
+    crop_marks: list[tuple[Decimal, Decimal, str]]
+
+
+def _crop_marks(x_mm: Decimal, y_mm: Decimal, width_mm: Decimal, height_mm: Decimal):
+    # Two short lines per corner, pointing away from the card along its edges
+    marks = []
+    offset = CROP_MARK_OFFSET_MM
+    for edge_x in (x_mm, x_mm + width_mm):
+        marks.append((edge_x, y_mm - offset - CROP_MARK_MM, "vertical"))
+        marks.append((edge_x, y_mm + height_mm + offset, "vertical"))
+    for edge_y in (y_mm, y_mm + height_mm):
+        marks.append((x_mm - offset - CROP_MARK_MM, edge_y, "horizontal"))
+        marks.append((x_mm + width_mm + offset, edge_y, "horizontal"))
+    return marks
+
+
+def get_grid(design: Design, layout: str) -> tuple[tuple[Decimal, Decimal], list[tuple[Decimal, Decimal]]]:
+    # Page size and the position of every card on a page
+    if layout == "pages":
+        return (design.width_mm, design.height_mm), [(Decimal(0), Decimal(0))]
+
+    page_width_mm, page_height_mm = A4_MM
+    columns = int((page_width_mm - 2 * SHEET_MARGIN_MM + SHEET_GAP_MM) // (design.width_mm + SHEET_GAP_MM))
+    rows = int((page_height_mm - 2 * SHEET_MARGIN_MM + SHEET_GAP_MM) // (design.height_mm + SHEET_GAP_MM))
+    if columns < 1 or rows < 1:
+        raise ValueError(f"Card ({design.width_mm}x{design.height_mm}mm) does not fit on an A4 sheet")
+
+    # Center the grid on the page
+    grid_width_mm = columns * design.width_mm + (columns - 1) * SHEET_GAP_MM
+    grid_height_mm = rows * design.height_mm + (rows - 1) * SHEET_GAP_MM
+    left_mm = (page_width_mm - grid_width_mm) / 2
+    top_mm = (page_height_mm - grid_height_mm) / 2
+    positions = [
+        (left_mm + column * (design.width_mm + SHEET_GAP_MM), top_mm + row * (design.height_mm + SHEET_GAP_MM))
+        for row in range(rows)
+        for column in range(columns)
+    ]
+    return (page_width_mm, page_height_mm), positions
+
+
+def render_sheet_html(design: Design, subjects: list[dict[str, Any]], layout: str = "pages") -> str:
+    if layout not in LAYOUTS:
+        raise ValueError(f"Unknown layout '{layout}', must be one of {', '.join(LAYOUTS)}")
+
+    (page_width_mm, page_height_mm), positions = get_grid(design, layout)
+    pages = []
+    for i, subject in enumerate(subjects):
+        if i % len(positions) == 0:
+            pages.append([])
+        x_mm, y_mm = positions[i % len(positions)]
+        marks = _crop_marks(x_mm, y_mm, design.width_mm, design.height_mm)
+        pages[-1].append(Slot(x_mm=x_mm, y_mm=y_mm, subject=subject, crop_marks=marks))
+
+    compiled = compile_design(design)
+    return get_template("sheet.html.j2").render(
+        design=design,
+        compiled=compiled,
+        css=compiled.sheet_css,
+        pages=pages,
+        page_width_mm=page_width_mm,
+        page_height_mm=page_height_mm,
+        crop_marks=layout == "a4",
+        crop_mark_mm=CROP_MARK_MM,
+    )
+
+
+def render_sheet(
+        path: str,
+        design: Design,
+        jobs: list[BadgeJob],
+        layout: str = "pages",
+        options: RenderOptions | None = None
+) -> None:
+    # Renders all jobs into one PDF, so stylesheets, fonts and the background/foreground layers
+    # are parsed once per document instead of once per badge
+    from weasyprint import HTML
+    options = options or RenderOptions()
+    subjects = [
+        build_subject(design, barcode_backend=options.barcode_backend, **prepare_job_data(design, job, options))
+        for job in jobs
+    ]
+    HTML(string=render_sheet_html(design, subjects, layout)).write_pdf(path, font_config=get_font_config())
+
+
+def _render_sheet_in_worker(path: str, jobs: list[BadgeJob], layout: str, options: RenderOptions | None) -> None:
+    render_sheet(path, worker_design(), jobs, layout, options)
+
+
+def _chunks(jobs: Iterable[BadgeJob], size: int) -> Iterator[list[BadgeJob]]:
+    iterator = iter(jobs)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def render_sheets(
+        path_prefix: str,
+        design: Design,
+        jobs: Iterable[BadgeJob],
+        layout: str = "pages",
+        options: RenderOptions | None = None,
+        cards_per_document: int = 100,
+        workers: int = 1
+) -> Iterator[str]:
+    # Splits the jobs into documents of at most cards_per_document cards, rendered in parallel
+    # when workers > 1. Yields the PDF paths in order.
+    chunks = ((f"{path_prefix}-{i:03d}.pdf", chunk) for i, chunk in enumerate(_chunks(jobs, cards_per_document), 1))
+    if workers <= 1:
+        for path, chunk in chunks:
+            render_sheet(path, design, chunk, layout, options)
+            yield path
+        return
+
+    # Like iter_batch, the design is sent once per worker and chunks are only built while fewer
+    # than two per worker are in flight
+    with worker_pool(workers, options or RenderOptions(), init_worker, (design,)) as executor:
+        pending: deque[tuple[str, Future]] = deque()
+        for path, chunk in chunks:
+            pending.append((path, executor.submit(_render_sheet_in_worker, path, chunk, layout, options)))
+            if len(pending) >= workers * 2:
+                path, future = pending.popleft()
+                future.result()
+                yield path
+        while pending:
+            path, future = pending.popleft()
+            future.result()
+            yield path
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import os
+from typing import Any
+
+from polarbadge.models.badge import BadgeJob, BadgeResult
+from polarbadge.models.card import Design
+from polarbadge.service.render import get_template_source
+
+MANIFEST_FILENAME = ".polarbadge-manifest.json"
+
+
+def design_fingerprint(design: Design, options: dict[str, Any] | None = None) -> str:
+    digest = hashlib.sha256()
+    digest.update(design.model_dump_json().encode("utf-8"))
+    for image in (design.background_png, design.foreground_png):
+        if image:
+            with open(image.path, "rb") as f:
+                digest.update(f.read())
+    digest.update(get_template_source().encode("utf-8"))
+    digest.update(json.dumps(options or {}, sort_keys=True).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def badge_fingerprint(design_hash: str, job: BadgeJob) -> str:
+    digest = hashlib.sha256(design_hash.encode("utf-8"))
+    fields = {k: v for k, v in job.data.items() if not isinstance(v, bytes)}
+    digest.update(json.dumps(fields, sort_keys=True, default=str).encode("utf-8"))
+    for key in sorted(job.data):
+        if isinstance(job.data[key], bytes):
+            digest.update(key.encode("utf-8"))
+            digest.update(job.data[key])
+    return digest.hexdigest()
+
+
+class BadgeManifest:
+    # Keeps track of the input hash and output files of every badge in the output directory,
+    # so unchanged badges can be skipped on the next run
+    def __init__(self, output_path: str):
+        self._path = os.path.join(output_path, MANIFEST_FILENAME)
+        self._entries: dict[str, dict[str, Any]] = {}
+        if os.path.exists(self._path):
+            with open(self._path, "r") as f:
+                self._entries = json.load(f)
+
+    @property
+    def user_ids(self) -> set[int]:
+        return set(map(int, self._entries))
+
+    def is_current(self, user_id: int, fingerprint: str) -> bool:
+        entry = self._entries.get(str(user_id))
+        if entry is None or entry["hash"] != fingerprint:
+            return False
+        return all(os.path.exists(path) for path in entry["files"])
+
+    def update(self, result: BadgeResult, fingerprint: str) -> None:
+        files = list(result.files)
+        entry = self._entries.get(str(result.user_id))
+        if entry:
+            for path in entry["files"]:
+                if path in files or not os.path.exists(path):
+                    continue
+                if path.startswith(result.file_path + "."):
+                    # Written by a run with another output format or rasterizer, kept (and still
+                    # removed with the badge)
+                    files.append(path)
+                else:
+                    # The file name contains the full name, so a name change leaves the old files behind
+                    os.remove(path)
+        self._entries[str(result.user_id)] = {"hash": fingerprint, "files": files}
+
+    def remove(self, user_id: int) -> None:
+        entry = self._entries.pop(str(user_id), None)
+        if entry:
+            for path in entry["files"]:
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def save(self) -> None:
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._entries, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._path)
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import os
+from typing import Any
+
+JOURNAL_FILENAME = ".polarbadge-journal"
+
+
+def run_key(design_hash: str, selection: dict[str, Any]) -> str:
+    # Identifies a run by what it renders, a journal is only resumed by the same run
+    digest = hashlib.sha256(design_hash.encode("utf-8"))
+    digest.update(json.dumps(selection, sort_keys=True, default=str).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RunJournal:
+    # Append-only record of the badges finished during a run, one user id per line after a header
+    # with the run key. Every line is flushed as it is written, so after a crash, a Ctrl-C or a
+    # GeekEvents outage the next run can pick up where this one stopped.
+    def __init__(self, output_path: str, key: str, resume: bool = False):
+        self._path = os.path.join(output_path, JOURNAL_FILENAME)
+        self.completed: set[int] = set()
+        if resume and os.path.exists(self._path):
+            self.completed, end = self._read(key)
+        if self.completed:
+            # Drops a line cut short by a crash, the next id would be appended to it otherwise
+            self._file = open(self._path, "r+")
+            self._file.truncate(end)
+            self._file.seek(end)
+        else:
+            self._file = open(self._path, "w")
+            self._file.write(json.dumps({"run": key}) + "\n")
+            self._file.flush()
+
+    def _read(self, key: str) -> tuple[set[int], int]:
+        # The finished badges and the offset after the last complete line
+        with open(self._path, "rb") as f:
+            header_line = f.readline()
+            try:
+                header = json.loads(header_line)
+            except ValueError:
+                return set(), 0
+            if not header_line.endswith(b"\n") or not isinstance(header, dict) or header.get("run") != key:
+                return set(), 0
+            completed = set()
+            end = len(header_line)
+            for line in f:
+                # A line cut short by a crash has no newline yet, that badge is done again
+                if not line.endswith(b"\n"):
+                    break
+                end += len(line)
+                if line.strip().isdigit():
+                    completed.add(int(line))
+            return completed, end
+
+    def record(self, user_id: int) -> None:
+        self.completed.add(user_id)
+        self._file.write(f"{user_id}\n")
+        self._file.flush()
+
+    def close(self) -> None:
+        # Keeps the journal for a later resume
+        if not self._file.closed:
+            os.fsync(self._file.fileno())
+            self._file.close()
+
+    def finish(self) -> None:
+        # The run is complete, there is nothing to resume
+        self.close()
+        os.remove(self._path)
@@ -0,0 +1,75 @@
+# Memory accounting and limits for worker processes, for long runs on small machines. A worker
+# can be given a ceiling on its heap, and gives freed memory back to the OS after every badge
+# instead of keeping it around for the next one.
+import ctypes
+import ctypes.util
+import os
+import resource
+import sys
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+# Least a worker needs on top of what it uses before rendering anything
+MIN_HEADROOM_MB = 64
+
+_libc = None
+
+
+def peak_rss() -> int:
+    # High-water mark of this process in bytes, ru_maxrss is in kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss() -> int:
+    # Resident memory of this process in bytes
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except OSError:
+        return peak_rss()
+
+
+def _data_size() -> int | None:
+    # Data segment of this process in bytes, what RLIMIT_DATA is compared with
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[5]) * _PAGE_SIZE
+    except OSError:
+        return None
+
+
+def check_memory_limit(max_memory_mb: int) -> None:
+    # Raises ValueError for a limit that leaves a process with the renderer imported no room for
+    # rendering. Called before starting workers, this process is at least as large as a worker
+    # started by the fork server.
+    # OpenBLAS reserves its buffers when numpy is imported, and spins instead of failing when the
+    # limit is in the way
+    import numpy  # noqa: F401
+    in_use = _data_size()
+    if in_use is not None and max_memory_mb < in_use / 2 ** 20 + MIN_HEADROOM_MB:
+        raise ValueError(f"A memory limit of {max_memory_mb} MiB leaves no room for rendering, a worker "
+                         f"uses about {in_use / 2 ** 20:.0f} MiB before rendering anything")
+
+
+def limit_memory(max_memory_mb: int) -> None:
+    # Caps the data segment (heap and anonymous mappings) of this process. An allocation beyond
+    # it raises MemoryError, which fails the badge being rendered instead of the machine swapping
+    # or the OOM killer picking a process. A limit that leaves no room for rendering is refused.
+    check_memory_limit(max_memory_mb)
+    _, hard = resource.getrlimit(resource.RLIMIT_DATA)
+    limit = max_memory_mb * 2 ** 20
+    if hard != resource.RLIM_INFINITY:
+        limit = min(limit, hard)
+    resource.setrlimit(resource.RLIMIT_DATA, (limit, hard))
+
+
+def release_memory() -> None:
+    # glibc keeps freed memory in its arenas for reuse, which after a badge with a large picture
+    # is tens of megabytes. Other C libraries give it back by themselves.
+    global _libc
+    if _libc is None:
+        path = ctypes.util.find_library("c")
+        _libc = ctypes.CDLL(path) if path else False
+    if _libc and hasattr(_libc, "malloc_trim"):
+        _libc.malloc_trim(0)
@@ -0,0 +1,214 @@
+# Output encoders: how a finished badge is written for the printer. Every encoder assembles the
+# whole file in a buffer that is allocated once per process and reused for every badge of the
+# same size, and writes it out in one go.
+#
+# - bmp: 24-bit BMP, what the printer driver has always been given
+# - png: lossless and compressed, for keeping an archive of what was printed
+# - rgb: raw RGB panel, 3 bytes per pixel, rows top to bottom
+# - cmyk: raw CMYK panel, 4 bytes per pixel, black generated from the grey component
+#
+# The K panel (--k-panel) is a 1-bit resin layer for ribbons with a black panel: near black
+# pixels in the text and barcode boxes, in rows padded to whole bytes, most significant bit
+# first, 1 is resin. Those pixels are left out of raw colour panels, archival formats keep them.
+import struct
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image as PImage
+
+from polarbadge.models.badge import OUTPUT_FORMATS, RenderOptions
+from polarbadge.models.card import Design
+from polarbadge.service.profiling import stage
+
+# Channels at or below this count as black for the K panel
+K_THRESHOLD = 48
+
+_BMP_HEADER = struct.Struct("<2sIHHIIiiHHIIiiII")
+
+
+def _k_boxes(design: Design) -> list[tuple[int, int, int, int]]:
+    # Text and barcode boxes in design orientation, as (left, top, right, bottom) in pixels
+    mm = design.mm_to_px
+    boxes = [
+        (mm(box.anchor_x_mm), mm(box.anchor_y_mm), mm(box.anchor_x_mm + box.width_mm),
+         mm(box.anchor_y_mm + box.height_mm))
+        for box in (design.text_nick, design.text_name, design.text_crew)
+    ]
+    if design.code_2d_box:
+        code = design.code_2d_box
+        # The caption goes below the code
+        boxes.append((mm(code.anchor_x_mm), mm(code.anchor_y_mm), mm(code.anchor_x_mm + code.size_mm),
+                      mm(code.anchor_y_mm + code.size_mm * 2)))
+    return boxes
+
+
+class OutputEncoder(ABC):
+    extension = ""
+
+    def __init__(self, k_panel: bool = False):
+        self.k_panel = k_panel
+        self._buffers = {}
+
+    def _buffer(self, name: str, size: int) -> bytearray:
+        buffer = self._buffers.get(name)
+        if buffer is None or len(buffer) != size:
+            buffer = self._buffers[name] = bytearray(size)
+        return buffer
+
+    def _to_array(self, design: Design, image: PImage.Image):
+        # Pixels as a numpy array in printer orientation (landscape), plus the K panel mask
+        import numpy as np
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        mask = None
+        if self.k_panel:
+            pixels = np.asarray(image)
+            mask = np.zeros(pixels.shape[:2], dtype=bool)
+            for left, top, right, bottom in _k_boxes(design):
+                box = pixels[top:bottom, left:right]
+                # Channel by channel, max(axis=2) over the short last axis is slow
+                brightest = np.maximum(np.maximum(box[..., 0], box[..., 1]), box[..., 2])
+                mask[top:bottom, left:right] |= brightest <= K_THRESHOLD
+            if design.is_portrait:
+                mask = np.ascontiguousarray(np.rot90(mask))
+        if design.is_portrait:
+            # Pillow rotates into a new contiguous image faster than numpy copies a rotated view
+            image = image.transpose(PImage.ROTATE_90)
+        return np.asarray(image), mask
+
+    def _write_k_panel(self, path: str, mask) -> str:
+        import numpy as np
+        height, width = mask.shape
+        row_bytes = (width + 7) // 8
+        buffer = self._buffer("k", row_bytes * height)
+        np.frombuffer(buffer, dtype=np.uint8).reshape(height, row_bytes)[:] = np.packbits(mask, axis=1)
+        k_path = path + ".k"
+        with open(k_path, "wb") as f:
+            f.write(buffer)
+        return k_path
+
+    @abstractmethod
+    def _encode(self, pixels, mask) -> memoryview:
+        # The whole file for the pixels in printer orientation, mask is the K panel or None
+        ...
+
+    def write(self, path: str, design: Design, image: PImage.Image) -> list[str]:
+        # Writes the badge (path without extension) and returns the files written
+        with stage("save") as span:
+            pixels, mask = self._to_array(design, image)
+            data = self._encode(pixels, mask)
+            files = [f"{path}.{self.extension}"]
+            with open(files[0], "wb") as f:
+                f.write(data)
+            span.add_bytes(len(data))
+            if mask is not None:
+                files.append(self._write_k_panel(path, mask))
+        return files
+
+
+class BmpEncoder(OutputEncoder):
+    extension = "bmp"
+
+    def _encode(self, pixels, mask) -> memoryview:
+        import numpy as np
+        height, width = pixels.shape[:2]
+        stride = (width * 3 + 3) & ~3
+        offset = 14 + 40
+        buffer = self._buffer("image", offset + stride * height)
+        pixels_per_meter = round(300 / 0.0254)
+        _BMP_HEADER.pack_into(
+            buffer, 0, b"BM", len(buffer), 0, 0, offset,
+            40, width, height, 1, 24, 0, stride * height, pixels_per_meter, pixels_per_meter, 0, 0
+        )
+        rows = np.frombuffer(buffer, dtype=np.uint8, offset=offset).reshape(height, stride)
+        # Bottom-up rows of BGR pixels, a channel at a time is much faster than reversing all three
+        bgr = rows[:, :width * 3].reshape(height, width, 3)
+        bottom_up = pixels[::-1]
+        for channel in range(3):
+            bgr[..., channel] = bottom_up[..., 2 - channel]
+        return memoryview(buffer)
+
+
+class PngEncoder(OutputEncoder):
+    extension = "png"
+
+    def __init__(self, k_panel: bool = False):
+        super().__init__(k_panel)
+        self._stream = BytesIO()
+
+    def _encode(self, pixels, mask) -> memoryview:
+        self._stream.seek(0)
+        self._stream.truncate()
+        PImage.fromarray(pixels).save(self._stream, format="PNG", compress_level=9, dpi=(300, 300))
+        return self._stream.getbuffer()
+
+
+class RgbEncoder(OutputEncoder):
+    extension = "rgb"
+
+    def _encode(self, pixels, mask) -> memoryview:
+        import numpy as np
+        buffer = self._buffer("image", pixels.size)
+        panel = np.frombuffer(buffer, dtype=np.uint8).reshape(pixels.shape)
+        panel[:] = pixels
+        if mask is not None:
+            panel[mask] = 255
+        return memoryview(buffer)
+
+
+class CmykEncoder(OutputEncoder):
+    extension = "cmyk"
+
+    def __init__(self, k_panel: bool = False):
+        import numpy as np
+        super().__init__(k_panel)
+        # K = 1 - max(R, G, B) and C = (1 - R - K) / (1 - K), the same for M and Y. The division
+        # is looked up by (max << 8 | channel) instead of computed for every pixel.
+        brightest = np.arange(256, dtype=np.uint32)[:, None]
+        value = np.minimum(np.arange(256, dtype=np.uint32)[None, :], brightest)
+        self._ink = ((brightest - value) * 255 // np.maximum(brightest, 1)).astype(np.uint8).ravel()
+        self._scratch = {}
+
+    def _encode(self, pixels, mask) -> memoryview:
+        import numpy as np
+        height, width = pixels.shape[:2]
+        buffer = self._buffer("image", height * width * 4)
+        panel = np.frombuffer(buffer, dtype=np.uint8).reshape(height, width, 4)
+        if self._scratch.get("shape") != (height, width):
+            self._scratch = {
+                "shape": (height, width),
+                "brightest": np.empty((height, width), dtype=np.uint8),
+                "index": np.empty((height, width), dtype=np.uint16),
+            }
+        brightest, index = self._scratch["brightest"], self._scratch["index"]
+        np.maximum(pixels[..., 0], pixels[..., 1], out=brightest)
+        np.maximum(brightest, pixels[..., 2], out=brightest)
+        np.subtract(255, brightest, out=panel[..., 3])
+        for channel in range(3):
+            np.left_shift(brightest, 8, out=index, dtype=np.uint16)
+            np.bitwise_or(index, pixels[..., channel], out=index)
+            panel[..., channel] = self._ink.take(index)
+        if mask is not None:
+            panel[mask] = 0
+        return memoryview(buffer)
+
+
+_ENCODERS = {
+    "bmp": BmpEncoder,
+    "png": PngEncoder,
+    "rgb": RgbEncoder,
+    "cmyk": CmykEncoder,
+}
+
+
+@lru_cache
+def get_encoder(output_format: str = "bmp", k_panel: bool = False) -> OutputEncoder:
+    # One per process and format, so the buffers are reused across badges
+    if output_format not in _ENCODERS:
+        raise ValueError(f"Unknown output format '{output_format}', must be one of {', '.join(OUTPUT_FORMATS)}")
+    return _ENCODERS[output_format](k_panel=k_panel)
+
+
+def write_output(path: str, design: Design, image: PImage.Image, options: RenderOptions) -> list[str]:
+    return get_encoder(options.output_format, options.k_panel).write(path, design, image)
@@ -1,62 +1,150 @@
-def find_face_center(buf):
+import hashlib
+import os
+from decimal import Decimal
+from functools import lru_cache
+from io import BytesIO
+
+from PIL import Image as PImage, ImageOps
+
+from polarbadge.models.card import Design
+from polarbadge.service.cache import BlobCache
+
+# Bump when normalize_picture changes its output, so memoized pictures are not reused
+NORMALIZE_VERSION = 1
+
+# Faces are searched for in a grayscale copy with this as its longest side
+DETECTION_SIZE_PX = 640
+
+FaceCenter = tuple[float, float]
+
+_FACE_CLASSIFIER = None
+# Face center per picture hash
+_face_centers: dict[str, FaceCenter | None] = {}
+
+
+def _get_face_classifier():
+    global _FACE_CLASSIFIER
+    if _FACE_CLASSIFIER is None:
+        import cv2
+        _FACE_CLASSIFIER = cv2.CascadeClassifier(
+            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
+        )
+    return _FACE_CLASSIFIER
+
+
+def find_face_center(buf) -> tuple[int, int] | tuple[None, None]:
     # https://stackoverflow.com/a/77865834
-    face_classifier = cv2.CascadeClassifier(
-        cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-    )
-    roi = face_classifier.detectMultiScale(
-        cv2.cvtColor(img, cv2.COLOR_RGB2GRAY), 
-        scaleFactor=1.5,
+    # buf is a grayscale image as a numpy array
+    roi = _get_face_classifier().detectMultiScale(
+        buf,
+        scaleFactor=1.2,
         minNeighbors=5,
-        minSize=(40, 40)
+        minSize=(24, 24)
     )
-    if roi:
-        x, y, w, h = roi[0]
-        center = np.round((x+w/2, y+h/2)).astype("int32")
-        return center
+    if len(roi):
+        # Go for the biggest face, that's most likely the person the picture is of
+        x, y, w, h = max(roi, key=lambda face: face[2] * face[3])
+        return round(x + w / 2), round(y + h / 2)
     return None, None
-        
 
-def _pillow_to_opencv(image: PImage):
-    # https://stackoverflow.com/a/14140796
-    image = image.convert("RGB")
-    image = np.array(image)
-    image = image[:, :, ::-1].copy()
-    return image
+
+def _pillow_to_gray_array(image: PImage.Image):
+    import numpy as np
+    image = image.convert("L")
+    image.thumbnail((DETECTION_SIZE_PX, DETECTION_SIZE_PX))
+    return np.asarray(image)
 
 
-def _get_pad_for_pic(image: PImage):
-    buf = _pillow_to_opencv(image)
+def _get_face_center_for_pic(image: PImage.Image) -> FaceCenter | None:
+    # Returns the face center as fractions of the picture's width and height
+    buf = _pillow_to_gray_array(image)
     center_x, center_y = find_face_center(buf)
-    return center_x, center_y
+    if center_x is None:
+        return None
+    height, width = buf.shape
+    return center_x / width, center_y / height
+
+
+def _decode(content: bytes) -> PImage.Image:
+    with PImage.open(BytesIO(content)) as pic:
+        return ImageOps.exif_transpose(pic)
+
+
+def _get_face_center_for_decoded(digest: str, image: PImage.Image) -> FaceCenter | None:
+    if digest not in _face_centers:
+        _face_centers[digest] = _get_face_center_for_pic(image)
+    return _face_centers[digest]
+
+
+def _crop_box(
+        size: tuple[int, int],
+        aspect: Decimal,
+        center: FaceCenter | None
+) -> tuple[int, int, int, int]:
+    # The largest box with the requested aspect ratio (width / height) that fits in the picture,
+    # as close to centered on the face as the picture edges allow
+    width, height = size
+    crop_width = min(width, round(height * aspect))
+    crop_height = min(height, round(width / aspect))
+    center_x, center_y = center or (0.5, 0.5)
+    left = min(max(round(center_x * width - crop_width / 2), 0), width - crop_width)
+    top = min(max(round(center_y * height - crop_height / 2), 0), height - crop_height)
+    return left, top, left + crop_width, top + crop_height
+
+
+def encode_picture(image: PImage.Image) -> bytes:
+    buffer = BytesIO()
+    if image.mode in ("RGBA", "LA", "P"):
+        image.save(buffer, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=90, optimize=True)
+    return buffer.getvalue()
 
 
-def _get_pad_fractions_for_image(image: Image)
-    with PImage.open(image.path) as pic:
-        center_x_px, center_y_px = _get_pad_for_pic(image)
-        width_px, height_px = pic.size
+def get_picture_mime(content: bytes) -> str:
+    if content.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if content.startswith(b"GIF8"):
+        return "image/gif"
+    if content[8:12] == b"WEBP":
+        return "image/webp"
+    return "image/png"
 
-    half_width_px = Decimal(width_px) / Decimal(2)
-    half_height_px = Decimal(height_px) / Decimal(2)
-    offset_x_px = half_width_px - center_x_px
-    offset_y_px = half_height_px - center_y_px
 
-    pad_left_frac = half_width_px / offset_x_px if offset_x_px else 0
-    pad_top_frac = half_height_px / offset_y_px if offset_y_px else 0
+@lru_cache
+def _get_normalized_cache(path: str) -> BlobCache:
+    return BlobCache(os.path.join(path, "normalized"))
 
-    return pad_left_frac, pad_top_frac
 
+def normalize_picture(
+        content: bytes,
+        design: Design,
+        face_crop: bool = True,
+        cache_path: str | None = None
+) -> bytes:
+    # Decodes the picture once, fixes the EXIF orientation, crops it around the face ("cover"
+    # only) and scales it down to the pixel size of the profile picture box on the printed card
+    box = design.image_profile
+    target_size = (design.mm_to_px(box.width_mm), design.mm_to_px(box.height_mm))
 
-def _get_pad_mm_for_image(image: Image, design: Design):
-    pad_left_frac, pad_top_frac = _get_pad_fractions_for_image(image)
-    box_width_mm = design.image_profile.width_mm
-    box_height_mm = design.image_profile.height_mm
-    pad_left_mm = box_width_mm * pad_left_frac if pad_left_frac else 0
-    pad_top_mm = box_height_mm * pad_top_frac if pad_top_frac else 0
-    return pad_left_mm, pad_top_mm
+    digest = hashlib.sha256(content).hexdigest()
+    cache = _get_normalized_cache(cache_path) if cache_path else None
+    cache_key = f"{NORMALIZE_VERSION}-{digest}-{target_size[0]}x{target_size[1]}-{box.scaling}-{face_crop}"
+    if cache and (cached := cache.get(cache_key)) is not None:
+        return cached
 
+    try:
+        image = _decode(content)
+    except OSError:
+        # Pillow can't read it (e.g. SVG or HEIC), the renderer gets it as it is
+        return content
+    if box.scaling == "cover":
+        center = _get_face_center_for_decoded(digest, image) if face_crop else None
+        image = image.crop(_crop_box(image.size, box.width_mm / box.height_mm, center))
+    # Never scale up, the browser does that just as well from the smaller picture
+    image.thumbnail(target_size, PImage.LANCZOS)
 
-def update_image_with_pad(image: Image, design: Design):
-    pad_left_mm, pad_top_mm = _get_pad_mm_for_image(image, design)
-    image.pad_left_mm = pad_left_mm
-    image.pad_top_mm = pad_top_mm
-    return image
+    normalized = encode_picture(image)
+    if cache:
+        cache.set(cache_key, normalized)
+    return normalized
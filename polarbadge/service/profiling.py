@@ -0,0 +1,151 @@
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterable, Iterator
+
+from polarbadge.models.badge import BadgeResult, StageSpan
+from polarbadge.service.memory import current_rss, peak_rss
+
+# Spans recorded in this process, None while profiling is off
+_spans: list[StageSpan] | None = None
+
+
+class _OpenStage:
+    def __init__(self):
+        self.bytes = 0
+
+    def add_bytes(self, count: int) -> None:
+        self.bytes += count
+
+
+def start_recording() -> None:
+    global _spans
+    _spans = []
+
+
+def stop_recording() -> list[StageSpan]:
+    global _spans
+    spans, _spans = _spans or [], None
+    return spans
+
+
+@contextmanager
+def collect(enabled: bool = True) -> Iterator[list[StageSpan]]:
+    # Records the spans of the block into their own list, e.g. for a single badge, without
+    # them also ending up in whatever was being recorded around it
+    global _spans
+    outer = _spans
+    _spans = [] if enabled else None
+    spans = _spans
+    try:
+        yield spans if spans is not None else []
+    finally:
+        _spans = outer
+
+
+@contextmanager
+def stage(name: str) -> Iterator[_OpenStage]:
+    # Times a stage of the pipeline when profiling is on. The caller can report how many bytes
+    # the stage produced through add_bytes on the yielded object.
+    open_stage = _OpenStage()
+    if _spans is None:
+        yield open_stage
+        return
+
+    start = time.time()
+    wall_started = time.perf_counter()
+    cpu_started = time.thread_time()
+    peak_before = peak_rss()
+    try:
+        yield open_stage
+    finally:
+        spans = _spans
+        if spans is not None:
+            # A stage that didn't raise the process' high-water mark can only be given what is
+            # resident at its end, so short spikes below an earlier peak go unnoticed
+            peak_after = peak_rss()
+            spans.append(StageSpan(
+                stage=name,
+                start_s=start,
+                wall_s=time.perf_counter() - wall_started,
+                cpu_s=time.thread_time() - cpu_started,
+                bytes=open_stage.bytes,
+                rss_bytes=peak_after if peak_after > peak_before else current_rss(),
+                pid=os.getpid(),
+                tid=threading.get_ident()
+            ))
+
+
+def _percentile(values: list[float], fraction: float) -> float:
+    # Nearest-rank percentile of sorted values
+    index = max(0, min(len(values) - 1, math.ceil(fraction * len(values)) - 1))
+    return values[index]
+
+
+class StageReport:
+    def __init__(self, spans: Iterable[StageSpan]):
+        self.spans = list(spans)
+
+    @classmethod
+    def from_results(cls, results: Iterable[BadgeResult], extra: Iterable[StageSpan] = ()) -> "StageReport":
+        spans = list(extra)
+        for result in results:
+            spans.extend(result.spans)
+        return cls(spans)
+
+    def summary(self) -> list[dict]:
+        stages: dict[str, list[StageSpan]] = {}
+        for span in self.spans:
+            stages.setdefault(span.stage, []).append(span)
+
+        rows = []
+        for name, spans in stages.items():
+            wall = sorted(span.wall_s for span in spans)
+            rows.append({
+                "stage": name,
+                "count": len(spans),
+                "p50_ms": _percentile(wall, 0.5) * 1000,
+                "p95_ms": _percentile(wall, 0.95) * 1000,
+                "max_ms": wall[-1] * 1000,
+                "cpu_ms": sum(span.cpu_s for span in spans) / len(spans) * 1000,
+                "bytes": sum(span.bytes for span in spans),
+                "peak_rss_bytes": max(span.rss_bytes for span in spans),
+            })
+        return rows
+
+    def format(self) -> str:
+        lines = [f"{'stage':<18} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'max ms':>9} {'cpu ms':>9} {'MiB':>9} "
+                 f"{'peak RSS':>9}"]
+        for row in self.summary():
+            lines.append(
+                f"{row['stage']:<18} {row['count']:>6} {row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f} "
+                f"{row['max_ms']:>9.1f} {row['cpu_ms']:>9.1f} {row['bytes'] / 2 ** 20:>9.2f} "
+                f"{row['peak_rss_bytes'] / 2 ** 20:>9.1f}"
+            )
+        return "\n".join(lines)
+
+    def write_chrome_trace(self, path: str) -> None:
+        # Chrome trace event format, open in chrome://tracing or https://ui.perfetto.dev
+        events = [
+            {
+                "name": span.stage,
+                "cat": "polarbadge",
+                "ph": "X",
+                "ts": span.start_s * 1_000_000,
+                "dur": span.wall_s * 1_000_000,
+                "pid": span.pid,
+                "tid": span.tid,
+                "args": {
+                    "cpu_ms": span.cpu_s * 1000,
+                    "bytes": span.bytes,
+                    "rss_mib": span.rss_bytes / 2 ** 20,
+                    **span.args
+                },
+            }
+            for span in self.spans
+        ]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
@@ -0,0 +1,197 @@
+# Native raster backend: draws a badge straight from the Design with Pillow, without going
+# through HTML, a layout engine and PDF. Mirrors the layering of card_style.css.j2: background,
+# profile picture, foreground, then text and barcode on top.
+import re
+from io import BytesIO
+from typing import NamedTuple, Sequence
+
+from PIL import Image as PImage, ImageChops, ImageDraw, ImageFont
+
+from polarbadge.models.card import Design, TextBox
+from polarbadge.service.barcode import render_datamatrix
+from polarbadge.service.compositor import get_compositor
+from polarbadge.service.fonts import get_image_font, text_length
+from polarbadge.service.profiling import stage
+
+_WHITESPACE = re.compile(r"\s+")
+
+# card_macros.html.j2 puts an empty inline svg above the crew text, which takes up a line
+_LEADING_LINES = {"text_crew": 1}
+
+
+def _wrap(text: str, font: ImageFont.FreeTypeFont, width_px: int) -> list[str]:
+    # Whitespace (including newlines) collapses like in HTML, lines wrap at the box width
+    lines = []
+    line = ""
+    for word in _WHITESPACE.split(text.strip()):
+        candidate = f"{line} {word}" if line else word
+        if line and text_length(font, candidate) > width_px:
+            lines.append(line)
+            line = word
+        else:
+            line = candidate
+    if line:
+        lines.append(line)
+    return lines
+
+
+def _draw_text(
+        draw: ImageDraw.ImageDraw,
+        text: str,
+        font: ImageFont.FreeTypeFont,
+        color: str,
+        left_px: int,
+        top_px: int,
+        width_px: int,
+        align_x: str = "center",
+        align_y: str = "top",
+        leading_lines: int = 0
+) -> None:
+    # Lines start at the top of the box and may overflow it, like the HTML text boxes. The text
+    # is an inline element in the template, so "middle" puts its centre half an x-height above
+    # the baseline, which moves the text down a bit and makes the lines taller.
+    ascent, descent = font.getmetrics()
+    shift = 0
+    if align_y == "middle":
+        x_height = -font.getbbox("x", anchor="ls")[1]
+        shift = round((ascent - descent) / 2 - x_height / 2)
+    baseline = top_px + leading_lines * (ascent + descent) + ascent + shift
+    for line in _wrap(text, font, width_px):
+        if align_x == "left":
+            x, anchor = left_px, "ls"
+        elif align_x == "right":
+            x, anchor = left_px + width_px, "rs"
+        else:
+            x, anchor = left_px + width_px / 2, "ms"
+        draw.text((x, baseline), line, font=font, fill=f"#{color}", anchor=anchor)
+        baseline += ascent + descent + shift
+
+
+def _draw_subject(
+        canvas: PImage.Image,
+        design: Design,
+        nick: str,
+        name: str,
+        crew: str,
+        user_id: int,
+        barcode_backend: str = "native",
+        debug: bool = False
+) -> None:
+    # Text and barcode go on top of the composited layers
+    mm = design.mm_to_px
+    with stage("text"):
+        draw = ImageDraw.Draw(canvas)
+        text_boxes: dict[str, str] = {"text_nick": nick, "text_name": name, "text_crew": crew}
+        for field, text in text_boxes.items():
+            box: TextBox = getattr(design, field)
+            if not text:
+                continue
+            font = box.font_override or design.base_font
+            _draw_text(
+                draw, str(text), get_image_font(font, design.dpi), font.color,
+                mm(box.anchor_x_mm), mm(box.anchor_y_mm), mm(box.width_mm),
+                box.align_x, box.align_y, _LEADING_LINES.get(field, 0)
+            )
+            if debug:
+                draw.rectangle(
+                    (mm(box.anchor_x_mm), mm(box.anchor_y_mm),
+                     mm(box.anchor_x_mm + box.width_mm), mm(box.anchor_y_mm + box.height_mm)),
+                    outline="red"
+                )
+
+    code_box = design.code_2d_box
+    if code_box:
+        with stage("barcode"):
+            size_px = mm(code_box.size_mm)
+            # The symbol is opaque, so it is pasted rather than blended
+            code = render_datamatrix(str(user_id), size_px, barcode_backend).convert("RGB")
+            canvas.paste(
+                code.resize((size_px, size_px), PImage.NEAREST),
+                (mm(code_box.anchor_x_mm), mm(code_box.anchor_y_mm))
+            )
+            if code_box.id_text_font:
+                # Centred under the code, and free to be wider than it
+                font = code_box.id_text_font
+                _draw_text(
+                    draw, str(user_id), get_image_font(font, design.dpi), font.color,
+                    mm(code_box.anchor_x_mm - code_box.size_mm), mm(code_box.anchor_y_mm + code_box.size_mm),
+                    mm(code_box.size_mm * 3)
+                )
+
+
+def _open_picture(profile_picture_path: str | None, profile_picture_content: bytes | None) -> PImage.Image | None:
+    if profile_picture_path:
+        with open(profile_picture_path, "rb") as f:
+            profile_picture_content = f.read()
+    if not profile_picture_content:
+        return None
+    try:
+        with PImage.open(BytesIO(profile_picture_content)) as picture:
+            return picture.convert("RGBA")
+    except OSError:
+        # Pillow can't read it (e.g. SVG, HEIC or a truncated upload), the card is drawn without it
+        return None
+
+
+def render_images(
+        design: Design,
+        subjects: Sequence[dict],
+        barcode_backend: str = "native",
+        debug: bool = False
+) -> list[PImage.Image]:
+    # Many cards at once, every subject has the keyword arguments of render_image. The pictures
+    # are blended into the layers in one batch, see polarbadge.service.compositor.
+    compositor = get_compositor(design)
+    with stage("composite"):
+        pictures = [
+            _open_picture(subject.get("profile_picture_path"), subject.get("profile_picture_content"))
+            for subject in subjects
+        ]
+        cards = compositor.compose(pictures)
+    for card, subject in zip(cards, subjects):
+        _draw_subject(
+            card, design, subject["nick"], subject["name"], subject["crew"], subject["user_id"],
+            barcode_backend, debug
+        )
+    return cards
+
+
+def render_image(
+        design: Design,
+        nick: str,
+        name: str,
+        crew: str,
+        user_id: int,
+        profile_picture_path: str | None = None,
+        profile_picture_content: bytes | None = None,
+        barcode_backend: str = "native",
+        debug: bool = False
+) -> PImage.Image:
+    # Same arguments as render_card, returns the card in design orientation
+    subject = {
+        "nick": nick, "name": name, "crew": crew, "user_id": user_id,
+        "profile_picture_path": profile_picture_path, "profile_picture_content": profile_picture_content,
+    }
+    return render_images(design, [subject], barcode_backend, debug)[0]
+
+
+class ImageDiff(NamedTuple):
+    # Mean absolute difference per channel (0-255)
+    mean: float
+    # Fraction of pixels where any channel differs by more than the threshold
+    changed: float
+    # Per pixel difference, brightened to be visible
+    image: PImage.Image
+
+
+def compare_images(a: PImage.Image, b: PImage.Image, threshold: int = 32) -> ImageDiff:
+    a, b = a.convert("RGB"), b.convert("RGB")
+    if a.size != b.size:
+        b = b.resize(a.size, PImage.LANCZOS)
+    difference = ImageChops.difference(a, b)
+    pixels = a.width * a.height
+    mean = sum(i % 256 * count for i, count in enumerate(difference.histogram())) / (pixels * 3)
+    red, green, blue = difference.split()
+    largest = ImageChops.lighter(ImageChops.lighter(red, green), blue)
+    changed = sum(largest.histogram()[threshold + 1:]) / pixels
+    return ImageDiff(mean=mean, changed=changed, image=difference.point(lambda value: min(255, value * 4)))
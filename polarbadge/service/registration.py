@@ -0,0 +1,179 @@
+# Registered NFC cards. The users file is an append-only journal with one CSV line per
+# registration (member id, NFC id, username, full name, crew), where a later line for a member
+# replaces their earlier card. Every desk keeps an index of it in memory and catches up on the
+# lines other desks appended before checking for duplicates, all under an exclusive lock on the
+# file, so two desks can't hand out the same card or register the same member twice.
+import csv
+import fcntl
+import io
+import os
+import threading
+from contextlib import contextmanager
+from typing import Iterator, NamedTuple
+
+
+class Registration(NamedTuple):
+    member_id: int
+    nfc_id: str
+    username: str
+    full_name: str
+    crew: str
+
+
+class RegistrationConflict(Exception):
+    def __init__(self, message: str, existing: Registration):
+        super().__init__(message)
+        self.existing = existing
+
+
+class AlreadyRegistered(RegistrationConflict):
+    # The member already has this card
+    pass
+
+
+class CardInUse(RegistrationConflict):
+    # The card belongs to another member
+    pass
+
+
+class MemberHasCard(RegistrationConflict):
+    # The member already has another card, add with replace=True to give them this one instead
+    pass
+
+
+def normalize_nfc_id(nfc_id: str) -> str:
+    # Readers differ in the case they type hex ids in
+    return nfc_id.strip().upper()
+
+
+class RegistrationStore:
+    def __init__(self, path: str, fsync_every: int = 16, fsync_interval_s: float = 2.0):
+        # Lines are written (and visible to other desks) right away, but only forced to disk every
+        # fsync_every registrations or fsync_interval_s seconds, whichever comes first
+        self._file = open(path, "a+b")
+        self._offset = 0
+        self._by_member: dict[int, Registration] = {}
+        self._by_nfc: dict[str, Registration] = {}
+        self._fsync_every = fsync_every
+        self._fsync_interval_s = fsync_interval_s
+        self._unsynced = 0
+        self._timer: threading.Timer | None = None
+        self._lock = threading.Lock()
+        with self._locked(fcntl.LOCK_SH):
+            self._catch_up()
+
+    @contextmanager
+    def _locked(self, operation: int) -> Iterator[None]:
+        # Between threads of this desk and, with flock, between desks
+        with self._lock:
+            fcntl.flock(self._file.fileno(), operation)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+
+    def _catch_up(self) -> None:
+        # Indexes the lines appended since the last call, by this or another desk. A line without
+        # its newline is still being written and is left for next time.
+        self._file.seek(self._offset)
+        data = self._file.read()
+        complete = data[:data.rfind(b"\n") + 1]
+        self._offset += len(complete)
+        for row in csv.reader(io.StringIO(complete.decode("utf-8"))):
+            if len(row) < 2 or not row[0].strip().isdigit():
+                continue
+            row = row + [""] * (5 - len(row))
+            # Older files were written without quoting, a comma in a name split it in two
+            crew = row[-1] if len(row) > 5 else row[4]
+            full_name = ",".join(row[3:-1]) if len(row) > 5 else row[3]
+            self._index(Registration(int(row[0]), normalize_nfc_id(row[1]), row[2], full_name, crew))
+
+    def _index(self, registration: Registration) -> None:
+        previous = self._by_member.get(registration.member_id)
+        if previous and self._by_nfc.get(previous.nfc_id) == previous:
+            del self._by_nfc[previous.nfc_id]
+        self._by_member[registration.member_id] = registration
+        self._by_nfc[registration.nfc_id] = registration
+
+    def refresh(self) -> None:
+        with self._locked(fcntl.LOCK_SH):
+            self._catch_up()
+
+    def get_by_member(self, member_id: int) -> Registration | None:
+        return self._by_member.get(member_id)
+
+    def get_by_nfc(self, nfc_id: str) -> Registration | None:
+        return self._by_nfc.get(normalize_nfc_id(nfc_id))
+
+    def __len__(self) -> int:
+        return len(self._by_member)
+
+    def __iter__(self) -> Iterator[Registration]:
+        return iter(self._by_member.values())
+
+    def _check(self, registration: Registration, replace: bool) -> None:
+        by_member = self._by_member.get(registration.member_id)
+        if by_member and by_member.nfc_id == registration.nfc_id:
+            raise AlreadyRegistered(f"{by_member.full_name} is already registered with this card", by_member)
+        by_nfc = self._by_nfc.get(registration.nfc_id)
+        if by_nfc:
+            raise CardInUse(f"Card {by_nfc.nfc_id} is already registered to {by_nfc.member_id} "
+                            f"({by_nfc.full_name})", by_nfc)
+        if by_member and not replace:
+            raise MemberHasCard(f"{by_member.full_name} is already registered with card {by_member.nfc_id}",
+                                by_member)
+
+    def check(self, member_id: int, nfc_id: str, replace: bool = False) -> None:
+        # Raises the RegistrationConflict adding this card would, as of what all desks wrote so far
+        self.refresh()
+        self._check(Registration(member_id, normalize_nfc_id(nfc_id), "", "", ""), replace)
+
+    def add(self, registration: Registration, replace: bool = False) -> Registration:
+        registration = registration._replace(nfc_id=normalize_nfc_id(registration.nfc_id))
+        line = io.StringIO()
+        csv.writer(line, lineterminator="\n").writerow(registration)
+        with self._locked(fcntl.LOCK_EX):
+            self._catch_up()
+            self._check(registration, replace)
+            # One write of a whole line, appended after whatever other desks wrote
+            self._file.write(line.getvalue().encode("utf-8"))
+            self._file.flush()
+            self._offset = self._file.tell()
+            self._index(registration)
+            self._unsynced += 1
+            if self._unsynced >= self._fsync_every:
+                self._sync()
+            elif self._timer is None:
+                self._timer = threading.Timer(self._fsync_interval_s, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+        return registration
+
+    def _sync(self) -> None:
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+        if self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def sync(self) -> None:
+        with self._lock:
+            if not self._file.closed:
+                self._sync()
+
+    def export_csv(self, path: str) -> int:
+        # Writes the current card of every member with a header, returns the number of members
+        self.refresh()
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(Registration._fields)
+            writer.writerows(sorted(self._by_member.values()))
+        os.replace(tmp_path, path)
+        return len(self._by_member)
+
+    def close(self) -> None:
+        with self._lock:
+            self._sync()
+            self._file.close()
@@ -1,24 +1,115 @@
-from io import BytesIO
+import os
+import re
+from tempfile import NamedTemporaryFile
+from functools import cache
 from typing import Any
 from base64 import b64encode
 
 import requests
-from PIL import ImageOps
-from jinja2 import Environment, PackageLoader, select_autoescape
-from treepoem import generate_barcode
+from jinja2 import Environment, PackageLoader, Template, select_autoescape
 
-from polarbadge.models.card import Design
+from polarbadge.models.badge import HTML_RASTERIZERS
+from polarbadge.models.card import CompiledDesign, Design
+from polarbadge.service.barcode import get_datamatrix_b64
+from polarbadge.service.fonts import get_font_config
+from polarbadge.service.picture import get_picture_mime
+from polarbadge.service.profiling import stage
 
 
-env = Environment(
-    loader=PackageLoader("polarbadge"),
-    autoescape=select_autoescape()
-)
+@cache
+def get_environment() -> Environment:
+    return Environment(
+        loader=PackageLoader("polarbadge"),
+        autoescape=select_autoescape()
+    )
+
+
+def get_template(name: str) -> Template:
+    return get_environment().get_template(name)
+
+
+_compiled_designs: dict[int, CompiledDesign] = {}
+
+
+TEMPLATE_NAMES = ("card.html.j2", "card_macros.html.j2", "card_style.css.j2", "sheet.html.j2")
+
+
+def get_template_source() -> str:
+    env = get_environment()
+    sources = [env.loader.get_source(env, name)[0] for name in TEMPLATE_NAMES]
+    return "".join(sources)
+
+
+def compile_design(design: Design) -> CompiledDesign:
+    # The compiled design keeps a reference to the design, so its id can't be reused while cached
+    compiled = _compiled_designs.get(id(design))
+    if compiled is None or compiled.design is not design:
+        compiled = CompiledDesign(
+            design=design,
+            background_b64=design.background_b64,
+            foreground_b64=design.foreground_b64,
+            external_fonts=design.get_external_fonts(),
+        )
+        style_template = get_template("card_style.css.j2")
+        compiled.css = style_template.render(
+            design=design,
+            compiled=compiled,
+            position="fixed",
+            layers_as_background=False
+        )
+        # Cards on a sheet are positioned within their own box, and the layers are referenced
+        # from the stylesheet so they are only decoded once per document
+        compiled.sheet_css = style_template.render(
+            design=design,
+            compiled=compiled,
+            position="absolute",
+            layers_as_background=True
+        )
+        _compiled_designs[id(design)] = compiled
+    return compiled
+
+
+# Subject fields are rendered as "\ufdd0<field>\ufdd0" into the card skeleton. U+FDD0 is a
+# noncharacter, so it doesn't turn up in a design.
+_MARKER = "\ufdd0"
+_MARKER_PATTERN = re.compile(f"{_MARKER}([a-z0-9_]+){_MARKER}")
+SUBJECT_FIELDS = ("user_id", "name", "nick", "crew", "pic_b64", "pic_mime", "code_b64")
+
+
+def get_card_skeleton(design: Design, debug: bool = False, has_code: bool = True) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # The card document for a design, rendered once with markers for the subject fields and split
+    # around them: (static parts, fields), with one more part than there are fields. The template
+    # only branches on the subject for the barcode, so that is part of the key.
+    compiled = compile_design(design)
+    key = (debug, has_code)
+    skeleton = compiled.card_skeletons.get(key)
+    if skeleton is None:
+        subject = {field: f"{_MARKER}{field}{_MARKER}" for field in SUBJECT_FIELDS}
+        if not has_code:
+            subject["code_b64"] = None
+        html = get_template("card.html.j2").render(
+            design=design, compiled=compiled, card=design.card, subject=subject, debug=debug
+        )
+        pieces = _MARKER_PATTERN.split(html)
+        skeleton = compiled.card_skeletons[key] = (tuple(pieces[0::2]), tuple(pieces[1::2]))
+    return skeleton
 
-template = env.get_template("card.html.j2")
 
 def render_to_string(context: dict[str, Any]) -> str:
-    return template.render(**context)
+    # Fills the subject into the card skeleton. The templates (.j2) aren't autoescaped, so the
+    # values go in as the template would print them.
+    subject = context["subject"]
+    parts, fields = get_card_skeleton(context["design"], context.get("debug", False), bool(subject.get("code_b64")))
+    pieces = [parts[0]]
+    for field, part in zip(fields, parts[1:]):
+        pieces.append(str(subject.get(field)))
+        pieces.append(part)
+    return "".join(pieces)
+
+
+def render_to_string_full(context: dict[str, Any]) -> str:
+    # Renders the whole template, for checking render_to_string against
+    return get_template("card.html.j2").render(**context)
 
 
 def _get_picture(url):
@@ -30,7 +121,7 @@ def _get_picture(url):
     return response.content
 
 
-def render_card(
+def build_subject(
         design: Design,
         nick: str,
         name: str,
@@ -38,74 +129,155 @@ def render_card(
         user_id: int,
         profile_picture_path: str | None = None,
         profile_picture_content: bytes | None = None,
-        debug: bool = False
-) -> str:
-
+        barcode_backend: str = "native"
+) -> dict[str, Any]:
     if profile_picture_path:
         if profile_picture_path.startswith("http"):
             pic = _get_picture(profile_picture_path)
         else:
-            with open(profile_picture_path, "b") as f:
+            with open(profile_picture_path, "rb") as f:
                 pic = f.read()
         pic_b64 = b64encode(pic).decode("utf-8")
+        pic_mime = get_picture_mime(pic)
     elif profile_picture_content:
         pic_b64 = b64encode(profile_picture_content).decode("utf-8")
+        pic_mime = get_picture_mime(profile_picture_content)
     else:
         pic_b64 = None
+        pic_mime = None
+
+    subject = {
+        "user_id": user_id,
+        "name": name,
+        "nick": nick,
+        "crew": crew,
+        "pic_b64": pic_b64,
+        "pic_mime": pic_mime
+    }
+
+    if design.code_2d_box:
+        size_px = design.mm_to_px(design.code_2d_box.size_mm)
+        with stage("barcode"):
+            subject["code_b64"] = get_datamatrix_b64(str(user_id), size_px, barcode_backend)
+
+    return subject
+
+
+def render_card(
+        design: Design,
+        nick: str,
+        name: str,
+        crew: str,
+        user_id: int,
+        profile_picture_path: str | None = None,
+        profile_picture_content: bytes | None = None,
+        barcode_backend: str = "native",
+        debug: bool = False
+) -> str:
 
     context = {
         "design": design,
+        "compiled": compile_design(design),
         "card": design.card,
         "userid": user_id,
-        "subject": {
-            "user_id": user_id,
-            "name": name,
-            "nick": nick,
-            "crew": crew,
-            "pic_b64": pic_b64
-        },
+        "subject": build_subject(
+            design,
+            nick=nick,
+            name=name,
+            crew=crew,
+            user_id=user_id,
+            profile_picture_path=profile_picture_path,
+            profile_picture_content=profile_picture_content,
+            barcode_backend=barcode_backend
+        ),
         "debug": debug
     }
 
-    if design.code_2d_box:
-        code_img = generate_barcode("datamatrix", str(user_id), scale=4)
-        code_img = ImageOps.expand(code_img, border=10, fill="white")
-
-        buffer = BytesIO()
-        code_img.save(buffer, format="PNG")
-        code_b64 = b64encode(buffer.getvalue()).decode("utf-8")
-        context["subject"]["code_b64"] = code_b64
-
-    return render_to_string(context)        
-
-
-def render_to_image(path, design, html) -> None:
-    # canvas = plutoprint.ImageCanvas.create_for_data(
-    #     memoryview(html.encode("utf-8")),
-    #     width_px,
-    #     height_px
-    # )
-    # canvas.write_to_png(path)
-
-    # book = plutoprint.Book(
-    #     size=plutoprint.PageSize(
-    #         float(width_mm) * plutoprint.UNITS_MM,
-    #         float(height_mm) * plutoprint.UNITS_MM
-    #     ),
-    #     media=plutoprint.MEDIA_TYPE_PRINT
-    # )
-    # book.load_html(html)
-    # book.write_to_png(path, width_px, height_px)
+    with stage("template") as span:
+        html = render_to_string(context)
+        span.add_bytes(len(html))
+    return html
+
 
+def _rasterize_poppler(design: Design, html: str):
     from weasyprint import HTML
     from pdf2image import convert_from_path
-    from PIL import Image
     data = HTML(string=html)
-    pdf_buffer = BytesIO()
-    data.write_pdf("/tmp/tmp.pdf")
-
-    image = convert_from_path("/tmp/tmp.pdf", dpi=300)[0]
-    if design.is_portrait:
-        image = image.transpose(Image.ROTATE_90)
-    image.convert("RGB")
-    image.save(path, "BMP")
+    # Every call gets its own scratch file, so parallel workers don't overwrite each other
+    with NamedTemporaryFile(prefix="polarbadge-", suffix=".pdf") as pdf_file:
+        with stage("write_pdf") as span:
+            data.write_pdf(pdf_file.name, font_config=get_font_config())
+            span.add_bytes(os.path.getsize(pdf_file.name))
+        with stage("rasterize"):
+            return convert_from_path(pdf_file.name, dpi=300)[0]
+
+
+def _rasterize_memory(design: Design, html: str):
+    # Keeps the PDF in memory and rasterizes it in-process, no temp file or poppler subprocess
+    from weasyprint import HTML
+    import pypdfium2
+    with stage("write_pdf") as span:
+        pdf_bytes = HTML(string=html).write_pdf(font_config=get_font_config())
+        span.add_bytes(len(pdf_bytes))
+    with stage("rasterize"):
+        pdf = pypdfium2.PdfDocument(pdf_bytes)
+        try:
+            page = pdf[0]
+            image = page.render(scale=300 / 72).to_pil()
+            page.close()
+        finally:
+            pdf.close()
+    return image
+
+
+def _rasterize_plutoprint(design: Design, html: str):
+    # Renders the HTML straight onto a pixel canvas, skipping the PDF step entirely
+    import plutoprint
+    from PIL import Image
+    book = plutoprint.Book(
+        size=plutoprint.PageSize(
+            float(design.width_mm) * plutoprint.UNITS_MM,
+            float(design.height_mm) * plutoprint.UNITS_MM
+        ),
+        media=plutoprint.MEDIA_TYPE_PRINT,
+        margins=plutoprint.PAGE_MARGINS_NONE
+    )
+    with stage("layout"):
+        book.load_html(html)
+
+    canvas = plutoprint.ImageCanvas(design.width_px, design.height_px, plutoprint.IMAGE_FORMAT_ARGB32)
+    canvas.clear_surface(1, 1, 1, 1)
+    # Page sizes are reported in points, while the canvas is drawn in CSS pixels
+    page_size = book.get_page_size()
+    canvas.scale(
+        design.width_px / (page_size.width / plutoprint.UNITS_PX),
+        design.height_px / (page_size.height / plutoprint.UNITS_PX)
+    )
+    with stage("rasterize"):
+        book.render_document(canvas)
+
+    image = Image.frombuffer(
+        "RGBA",
+        (canvas.get_width(), canvas.get_height()),
+        canvas.get_data(),
+        "raw",
+        "BGRA",
+        canvas.get_stride(),
+        1
+    )
+    return image.convert("RGB")
+
+
+_RASTERIZER_FUNCTIONS = {
+    "poppler": _rasterize_poppler,
+    "memory": _rasterize_memory,
+    "plutoprint": _rasterize_plutoprint,
+}
+
+
+def rasterize(design: Design, html: str, rasterizer: str = "poppler"):
+    # The card HTML as an image in design orientation
+    if rasterizer not in _RASTERIZER_FUNCTIONS:
+        raise ValueError(f"Unknown HTML rasterizer '{rasterizer}', must be one of {', '.join(HTML_RASTERIZERS)}")
+    return _RASTERIZER_FUNCTIONS[rasterizer](design, html)
+
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Iterable, NamedTuple
+
+from polarbadge.models.geekevents import CrewMember, CrewMemberSummary
+from polarbadge.service.crew_list import iter_crew_items
+from polarbadge.service.geekevents import CREW_LIST_CHUNK_SIZE, GEClient
+
+ROSTER_FILENAME = "roster.sqlite3"
+
+# Bump when the schema changes, the snapshot is then dropped and synced again
+SCHEMA_VERSION = 3
+
+_SUMMARY_COLUMNS = ", ".join(CrewMemberSummary._fields)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS member (
+    user_id INTEGER PRIMARY KEY,
+    username TEXT NOT NULL,
+    first_name TEXT NOT NULL,
+    last_name TEXT NOT NULL,
+    profile_image TEXT NOT NULL,
+    crew TEXT NOT NULL,
+    role TEXT NOT NULL,
+    digest TEXT NOT NULL,
+    -- The crew member as GeekEvents sent it, only validated when read as a CrewMember
+    data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS member_crew ON member (crew);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+# Members in the order of the crew list on GeekEvents, which is also the print order. The order is
+# one JSON array of user ids in meta, so a member joining or leaving doesn't rewrite everyone after.
+_ORDERED_MEMBERS = (
+    "member JOIN json_each((SELECT value FROM meta WHERE key = 'order')) AS crew_order "
+    "ON crew_order.value = member.user_id"
+)
+
+
+class SyncResult(NamedTuple):
+    added: int
+    updated: int
+    removed: int
+    # The crew list was unchanged since the last sync (304 Not Modified)
+    not_modified: bool = False
+
+
+def _digest(item: dict) -> str:
+    return hashlib.sha256(json.dumps(item, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+class RosterStore:
+    # Local snapshot of the crew list in SQLite, indexed on everything we look crew members up
+    # by. Synced from GeekEvents when online, and usable on its own when not.
+    def __init__(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+            self._db.executescript("DROP TABLE IF EXISTS member; DROP TABLE IF EXISTS meta;")
+            self._db.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        self._db.close()
+
+    def _get_meta(self, key: str) -> str | None:
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: str | None) -> None:
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    @property
+    def synced_at(self) -> float | None:
+        # Unix time of the last successful sync, None if there is no snapshot yet
+        value = self._get_meta("synced_at")
+        return float(value) if value else None
+
+    def __len__(self) -> int:
+        return self._db.execute("SELECT COUNT(*) FROM member").fetchone()[0]
+
+    def sync(self, client: GEClient) -> SyncResult:
+        # Delta sync: the crew list is revalidated with the ETag of the previous sync, and only
+        # members whose data changed are written. The list is parsed while it is downloaded.
+        with client.get_crew_list(etag=self._get_meta("etag")) as response:
+            if response.status_code == 304:
+                with self._db:
+                    self._set_meta("synced_at", str(time.time()))
+                return SyncResult(added=0, updated=0, removed=0, not_modified=True)
+
+            known = dict(self._db.execute("SELECT user_id, digest FROM member"))
+            order: dict[int, None] = {}
+            added = updated = 0
+            with self._db:
+                for item in iter_crew_items(response.iter_content(CREW_LIST_CHUNK_SIZE)):
+                    user_id = int(item["user_id"])
+                    order[user_id] = None
+                    digest = _digest(item)
+                    if known.get(user_id) == digest:
+                        continue
+                    if user_id in known:
+                        updated += 1
+                    else:
+                        added += 1
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO member "
+                        "(user_id, username, first_name, last_name, profile_image, crew, role, digest, data) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                        (user_id, item["username"], item["first_name"], item["last_name"], item["profile_image"],
+                         item["crew"], item["role"], digest, json.dumps(item))
+                    )
+                removed = known.keys() - order.keys()
+                self._db.executemany("DELETE FROM member WHERE user_id = ?", [(user_id,) for user_id in removed])
+                self._set_meta("order", json.dumps(list(order)))
+                self._set_meta("etag", response.headers.get("ETag"))
+                self._set_meta("synced_at", str(time.time()))
+        return SyncResult(added=added, updated=updated, removed=len(removed))
+
+    @staticmethod
+    def _where(user_ids: Iterable[int] | None, crews: Iterable[str] | None) -> tuple[str, list]:
+        conditions = []
+        params: list = []
+        for column, values in (("user_id", user_ids), ("crew", crews)):
+            if values is not None:
+                values = list(values)
+                conditions.append(f"{column} IN ({', '.join('?' * len(values))})")
+                params.extend(values)
+        return (f"WHERE {' OR '.join(conditions)}" if conditions else ""), params
+
+    def get(self, user_id: int) -> CrewMember | None:
+        row = self._db.execute("SELECT data FROM member WHERE user_id = ?", (user_id,)).fetchone()
+        return CrewMember.model_validate_json(row[0]) if row else None
+
+    def summaries(
+            self,
+            user_ids: Iterable[int] | None = None,
+            crews: Iterable[str] | None = None
+    ) -> list[CrewMemberSummary]:
+        # Everyone, or only the given users and everyone in the given crews, in crew list order. Only
+        # the fields badges are made from, straight from their columns.
+        where, params = self._where(user_ids, crews)
+        rows = self._db.execute(
+            f"SELECT {_SUMMARY_COLUMNS} FROM {_ORDERED_MEMBERS} {where} ORDER BY crew_order.key", params
+        )
+        return [CrewMemberSummary(*row) for row in rows]
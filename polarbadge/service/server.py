@@ -0,0 +1,297 @@
+# Local render service for reprints: a small HTTP server, on TCP or a Unix socket, in front of a
+# pool of warm worker processes that already have the design, fonts, template and layers loaded.
+#
+#   POST /badges/<user id>   renders the badge, answers with the result as JSON
+#   GET  /status             workers, queued and rendering requests
+#
+# Requests go into a bounded queue, a dispatcher thread takes them out one at a time, looks the
+# user up and fetches the picture, and hands the job to the pool. At most one render per worker is
+# in flight, the rest wait in the queue, and requests beyond the queue are turned away with a 503.
+import http.server
+import json
+import os
+import queue
+import re
+import signal
+import socketserver
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable
+
+from polarbadge.models.badge import BadgeJob, BadgeResult, RenderOptions
+from polarbadge.models.card import Design
+from polarbadge.service.batch import Designs, init_worker, render_in_worker
+from polarbadge.service.spool import BadgeSink
+
+LISTEN_TYPES = ("tcp", "unix")
+
+# Looks a user up and builds their job, None for unknown users. Called from the dispatcher thread
+# only, so it may hold on to things that can't be shared between threads (like a SQLite roster).
+JobLookup = Callable[[int], BadgeJob | None]
+
+_BADGE_PATH = re.compile(r"^/badges/(\d+)/?$")
+
+
+def _init_service_worker(design: Design, options: RenderOptions, designs: Designs | None) -> None:
+    # Ctrl-C reaches the whole process group, the service stops its workers itself
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    init_worker(design, warm_options=options, designs=designs)
+
+
+def _worker_pid() -> int:
+    # Keeps a worker that is ready busy for a moment, so the next task goes to one still warming up
+    time.sleep(0.05)
+    return os.getpid()
+
+
+class QueueFull(Exception):
+    pass
+
+
+class UnknownUser(LookupError):
+    pass
+
+
+class RenderService:
+    def __init__(
+            self,
+            design: Design,
+            options: RenderOptions,
+            open_lookup: Callable[[], JobLookup],
+            workers: int = 2,
+            max_queue: int = 16,
+            sink: BadgeSink | None = None,
+            designs: Designs | None = None
+    ):
+        # open_lookup is called once in the dispatcher thread, which owns what it opens
+        self.workers = workers
+        self._options = options
+        self._open_lookup = open_lookup
+        self._sink = sink
+        self._queue: queue.Queue[tuple[int, Future] | None] = queue.Queue(maxsize=max_queue)
+        self._slots = threading.BoundedSemaphore(workers)
+        self._rendering = 0
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._startup_error: BaseException | None = None
+        self._initargs = (design, options, designs)
+        # Set when a worker died, the dispatcher starts a new pool before the next render
+        self._broken = threading.Event()
+        self._executor = self._new_executor()
+        self._dispatcher = threading.Thread(target=self._dispatch, name="polarbadge-dispatcher", daemon=True)
+
+    def _new_executor(self) -> ProcessPoolExecutor:
+        return ProcessPoolExecutor(
+            max_workers=self.workers, initializer=_init_service_worker, initargs=self._initargs
+        )
+
+    def _warm_up(self) -> None:
+        # Every worker renders a badge before the service takes requests
+        ready = set()
+        while len(ready) < self.workers:
+            futures = [self._executor.submit(_worker_pid) for _ in range(self.workers)]
+            ready.update(future.result() for future in futures)
+
+    def _replace_executor(self) -> None:
+        # A worker that dies (killed for memory, crashed in a native library) breaks the whole pool,
+        # and every later render would fail with it. Requests wait in the queue meanwhile.
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._executor = self._new_executor()
+        self._broken.clear()
+        try:
+            self._warm_up()
+        except BrokenProcessPool:
+            # Workers that can't even start, the next request tries again
+            self._broken.set()
+
+    def start(self) -> None:
+        # Starts every worker and opens the lookup, returns once all of it is ready
+        self._warm_up()
+        self._dispatcher.start()
+        self._ready.wait()
+        if self._startup_error:
+            raise self._startup_error
+
+    def stop(self) -> None:
+        self._queue.put(None)
+        self._dispatcher.join()
+        self._executor.shutdown(cancel_futures=True)
+        if self._sink:
+            self._sink.close()
+
+    @property
+    def status(self) -> dict:
+        with self._lock:
+            rendering = self._rendering
+        return {"workers": self.workers, "queued": self._queue.qsize(), "rendering": rendering}
+
+    def submit(self, user_id: int) -> Future:
+        # A future for the BadgeResult, raises QueueFull when there is no room for another request
+        future = Future()
+        try:
+            self._queue.put_nowait((user_id, future))
+        except queue.Full:
+            raise QueueFull(f"{self._queue.maxsize} requests are already waiting")
+        return future
+
+    def _dispatch(self) -> None:
+        try:
+            lookup = self._open_lookup()
+        except BaseException as e:
+            self._startup_error = e
+            return
+        finally:
+            self._ready.set()
+
+        while (item := self._queue.get()) is not None:
+            user_id, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            # Waits for a free worker, so requests queue here and not in the pool
+            self._slots.acquire()
+            try:
+                job = lookup(user_id)
+                if job is None:
+                    raise UnknownUser(f"No crew member with user id {user_id}")
+                if self._broken.is_set():
+                    self._replace_executor()
+                render = self._executor.submit(render_in_worker, job, self._options)
+            except Exception as e:
+                if isinstance(e, BrokenProcessPool):
+                    self._broken.set()
+                self._slots.release()
+                future.set_exception(e)
+                continue
+            with self._lock:
+                self._rendering += 1
+            render.add_done_callback(lambda render, future=future: self._finish(render, future))
+
+    def _finish(self, render: Future, future: Future) -> None:
+        with self._lock:
+            self._rendering -= 1
+        # Before the slot is free, so the dispatcher doesn't hand the next job to the broken pool
+        if isinstance(render.exception(), BrokenProcessPool):
+            self._broken.set()
+        self._slots.release()
+        if render.exception():
+            future.set_exception(render.exception())
+            return
+        result = render.result()
+        if result.ok and self._sink:
+            try:
+                self._sink.send(result)
+            except OSError as e:
+                result.error = f"Rendered, but could not hand the badge to the printer spool: {e}"
+        future.set_result(result)
+
+
+def _result_json(result: BadgeResult) -> dict:
+    return {
+        "user_id": result.user_id,
+        "full_name": result.full_name,
+        "files": [os.path.abspath(file) for file in result.files],
+        "elapsed_ms": round(result.elapsed_s * 1000, 1),
+        "error": result.error,
+    }
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    server_version = "polarbadge"
+    service: RenderService
+    request_timeout_s: float
+    log: Callable[[str], None]
+
+    def _send_json(self, status: int, body: dict, headers: dict | None = None) -> None:
+        data = (json.dumps(body) + "\n").encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/") == "/status":
+            self._send_json(200, self.service.status)
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def do_POST(self) -> None:
+        import requests
+
+        match = _BADGE_PATH.match(self.path)
+        if not match:
+            self._send_json(404, {"error": "Not found"})
+            return
+
+        user_id = int(match.group(1))
+        started = time.perf_counter()
+        try:
+            result = self.service.submit(user_id).result(timeout=self.request_timeout_s)
+        except QueueFull as e:
+            self._send_json(503, {"error": str(e)}, headers={"Retry-After": "1"})
+            return
+        except UnknownUser as e:
+            self._send_json(404, {"error": str(e)})
+            return
+        except requests.RequestException as e:
+            self._send_json(502, {"error": f"Could not fetch the picture: {e}"})
+            return
+        except TimeoutError:
+            self._send_json(504, {"error": f"Not rendered within {self.request_timeout_s:.0f}s"})
+            return
+        except Exception as e:
+            self._send_json(500, {"error": f"{type(e).__name__}: {e}"})
+            return
+
+        self._send_json(200 if result.ok else 500, _result_json(result))
+        total_ms = (time.perf_counter() - started) * 1000
+        self.log(f"{user_id} ({result.full_name}): {'rendered' if result.ok else 'failed'} in {total_ms:.0f}ms")
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else "unix"
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+
+class _UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self) -> None:
+        # A socket left behind by a server that didn't shut down cleanly
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+        super().server_bind()
+        self.server_name = "localhost"
+        self.server_port = 0
+
+    def server_close(self) -> None:
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.remove(self.server_address)
+
+
+def make_server(
+        listen: str,
+        service: RenderService,
+        request_timeout_s: float = 60,
+        log: Callable[[str], None] = print
+) -> socketserver.BaseServer:
+    # listen is "tcp:HOST:PORT" or "unix:PATH"
+    listen_type, _, address = listen.partition(":")
+    handler = type("Handler", (_Handler,), {
+        "service": service,
+        "request_timeout_s": request_timeout_s,
+        "log": staticmethod(log),
+    })
+    host, _, port = address.rpartition(":")
+    if listen_type not in LISTEN_TYPES or not address or (listen_type == "tcp" and not (host and port.isdigit())):
+        raise ValueError(f"Invalid address '{listen}', must be tcp:HOST:PORT or unix:PATH")
+    if listen_type == "unix":
+        return _UnixHTTPServer(address, handler)
+    return http.server.ThreadingHTTPServer((host, int(port)), handler)
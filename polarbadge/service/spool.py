@@ -0,0 +1,88 @@
+import json
+import os
+import shutil
+import socket
+from abc import ABC, abstractmethod
+
+from polarbadge.models.badge import BadgeResult
+
+SINK_TYPES = ("dir", "fifo", "unix")
+
+
+class BadgeSink(ABC):
+    # Receives finished badges in order, for a printer driver script to pick up. Writes may
+    # block while the consumer is busy, which holds back the render pipeline.
+    @abstractmethod
+    def send(self, result: BadgeResult) -> None:
+        ...
+
+    def close(self) -> None:
+        pass
+
+
+class DirectorySink(BadgeSink):
+    # Moves print files into a spool directory in one rename, so a watcher never sees half a file
+    def __init__(self, path: str):
+        self._path = path
+        os.makedirs(self._path, exist_ok=True)
+
+    def send(self, result: BadgeResult) -> None:
+        for file in result.print_files:
+            target = os.path.join(self._path, os.path.basename(file))
+            tmp_target = os.path.join(self._path, f".{os.path.basename(file)}.tmp")
+            try:
+                os.link(file, tmp_target)
+            except OSError:
+                shutil.copyfile(file, tmp_target)
+            os.replace(tmp_target, target)
+
+
+class FifoSink(BadgeSink):
+    # Writes one line per print file to a named pipe. Opening blocks until a reader shows up.
+    def __init__(self, path: str):
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        self._pipe = open(path, "w", buffering=1)
+
+    def send(self, result: BadgeResult) -> None:
+        for file in result.print_files:
+            self._pipe.write(os.path.abspath(file) + "\n")
+
+    def close(self) -> None:
+        self._pipe.close()
+
+
+class SocketSink(BadgeSink):
+    # Sends one JSON line per badge to a listening Unix socket
+    def __init__(self, path: str):
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(path)
+
+    def send(self, result: BadgeResult) -> None:
+        message = {
+            "user_id": result.user_id,
+            "full_name": result.full_name,
+            "files": [os.path.abspath(file) for file in result.print_files],
+        }
+        self._socket.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+    def close(self) -> None:
+        self._socket.close()
+
+
+def parse_sink_spec(spec: str) -> tuple[str, str]:
+    # spec is "<type>:<path>", e.g. "dir:/var/spool/badges" or "fifo:/tmp/badges"
+    sink_type, _, path = spec.partition(":")
+    if sink_type not in SINK_TYPES or not path:
+        raise ValueError(f"Invalid sink '{spec}', must be <type>:<path> with type one of {', '.join(SINK_TYPES)}")
+    return sink_type, path
+
+
+def get_sink(spec: str) -> BadgeSink:
+    # Raises OSError when the sink can't be opened, e.g. nobody listens on the socket
+    sink_type, path = parse_sink_spec(spec)
+    if sink_type == "dir":
+        return DirectorySink(path)
+    if sink_type == "fifo":
+        return FifoSink(path)
+    return SocketSink(path)
@@ -0,0 +1,31 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Only imported once a command actually renders, see polarbadge/parties/pp33/cli.py
+HEAVY_MODULES = ["weasyprint", "pdf2image", "cv2", "numpy"]
+
+_SCRIPT = """
+import json, runpy, sys
+args, modules = map(json.loads, sys.argv[1:])
+sys.argv = ["cli.py", *args]
+try:
+    runpy.run_path("cli.py", run_name="__main__")
+except SystemExit:
+    pass
+print(json.dumps(sorted(name for name in modules if name in sys.modules)))
+"""
+
+
+@pytest.mark.parametrize("args", [["--help"], ["pp33-everyone", "--help"], ["pp33-serve", "--help"]])
+def test_help_does_not_import_the_renderer(args):
+    output = subprocess.run(
+        [sys.executable, "-c", _SCRIPT, json.dumps(args), json.dumps(HEAVY_MODULES)],
+        cwd=ROOT, capture_output=True, text=True, check=True
+    ).stdout
+    assert json.loads(output.splitlines()[-1]) == []
@@ -0,0 +1,33 @@
+import json
+
+import pytest
+
+from polarbadge.service.crew_list import iter_crew_items
+
+MEMBERS = {
+    "17": {"user_id": 17, "first_name": "Åsmund", "last_name": "Ødegård", "crew": "Tech", "age": 1234},
+    "4": {"user_id": 4, "first_name": "Kari", "last_name": "Nordmann 😀", "crew": "Info", "tags": [1, 2.5, None]},
+    "230": {"user_id": 230, "first_name": "Ola", "last_name": "\"Quoted\" {braces}", "crew": "Tech", "ok": True},
+}
+
+
+def _chunks(data: bytes, size: int) -> list[bytes]:
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@pytest.mark.parametrize("indent", [None, 2])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 64, 1 << 16])
+def test_records_split_across_chunks(size, indent):
+    # Small chunks cut records, strings, numbers and multi-byte characters in half
+    data = json.dumps(MEMBERS, indent=indent, ensure_ascii=False).encode("utf-8")
+    assert list(iter_crew_items(_chunks(data, size))) == list(MEMBERS.values())
+
+
+def test_empty_list():
+    assert list(iter_crew_items([b" {", b" } "])) == []
+
+
+@pytest.mark.parametrize("data", [b"", b'{"1": {"user_id": 1}', b'{"1": {"user_id": 1', b"[]", b'{"1": 1 "2": 2}'])
+def test_malformed_list(data):
+    with pytest.raises(ValueError):
+        list(iter_crew_items(_chunks(data, 3)))
@@ -0,0 +1,34 @@
+import shutil
+
+import pytest
+from PIL import ImageOps
+
+from polarbadge.service.datamatrix import encode
+
+treepoem = pytest.importorskip("treepoem")
+
+# Badges encode the user ID. Digits are encoded the same way by every encoder (ASCII, two digits
+# per codeword), so the symbols must be identical module for module. Covers symbols with one and
+# with several data regions.
+PAYLOADS = ["7", "1234", "123456", "31415926", "1" * 24, "2" * 44, "3" * 72, "4" * 120, "5" * 200]
+
+
+def _reference_matrix(payload: str, size: int) -> list[list[bool]]:
+    # BWIPP through Ghostscript, sampled at the module centers of the symbol's bounding box
+    image = treepoem.generate_barcode("datamatrix", payload).convert("L")
+    left, top, right, bottom = ImageOps.invert(image).getbbox()
+    module_width, module_height = (right - left) / size, (bottom - top) / size
+    return [
+        [
+            image.getpixel((int(left + (x + 0.5) * module_width), int(top + (y + 0.5) * module_height))) < 128
+            for x in range(size)
+        ]
+        for y in range(size)
+    ]
+
+
+@pytest.mark.skipif(shutil.which("gs") is None, reason="treepoem needs Ghostscript")
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_native_matches_treepoem(payload):
+    matrix = encode(payload)
+    assert _reference_matrix(payload, len(matrix)) == matrix
@@ -0,0 +1,80 @@
+import os
+from decimal import Decimal
+
+import pytest
+
+from polarbadge.models.badge import BadgeJob, BadgeResult
+from polarbadge.parties.pp33.spec import design
+from polarbadge.service.incremental import BadgeManifest, badge_fingerprint, design_fingerprint
+
+LOOK = {"rasterizer": "poppler", "output_format": "bmp"}
+
+
+def _job(**data) -> BadgeJob:
+    return BadgeJob(user_id=7, full_name="First Last", file_path="/out/7", data={
+        "nick": "nick", "name": "First Last", "crew": "Tech", "user_id": 7,
+        "profile_picture_content": b"picture", **data,
+    })
+
+
+def _result(path: str, *extensions: str) -> BadgeResult:
+    files = [f"{path}.{extension}" for extension in extensions]
+    for file in files:
+        with open(file, "wb") as f:
+            f.write(b"badge")
+    return BadgeResult(user_id=7, full_name="First Last", file_path=path, files=files)
+
+
+def test_design_fingerprint():
+    unchanged = design.model_copy(deep=True)
+    text_nick = design.text_nick.model_copy(update={"anchor_x_mm": Decimal("1")})
+    moved = design.model_copy(update={"text_nick": text_nick})
+    assert design_fingerprint(unchanged, LOOK) == design_fingerprint(design, LOOK)
+    assert design_fingerprint(moved, LOOK) != design_fingerprint(design, LOOK)
+    assert design_fingerprint(design, {**LOOK, "output_format": "png"}) != design_fingerprint(design, LOOK)
+
+
+@pytest.mark.parametrize("changed", [
+    {"nick": "other"},
+    {"crew": "Info"},
+    {"profile_picture_content": b"other picture"},
+    {"profile_picture_content": None},
+])
+def test_badge_fingerprint(changed):
+    design_hash = design_fingerprint(design, LOOK)
+    assert badge_fingerprint(design_hash, _job()) == badge_fingerprint(design_hash, _job())
+    assert badge_fingerprint(design_hash, _job(**changed)) != badge_fingerprint(design_hash, _job())
+    assert badge_fingerprint("other design", _job()) != badge_fingerprint(design_hash, _job())
+
+
+def test_unchanged_badge_is_skipped(tmp_path):
+    fingerprint = badge_fingerprint(design_fingerprint(design, LOOK), _job())
+    manifest = BadgeManifest(str(tmp_path))
+    assert not manifest.is_current(7, fingerprint)
+    manifest.update(_result(str(tmp_path / "7-First Last"), "bmp"), fingerprint)
+    manifest.save()
+
+    manifest = BadgeManifest(str(tmp_path))
+    assert manifest.user_ids == {7}
+    assert manifest.is_current(7, fingerprint)
+    assert not manifest.is_current(7, badge_fingerprint(design_fingerprint(design, LOOK), _job(nick="other")))
+    # A badge file deleted by hand is rendered again
+    os.remove(tmp_path / "7-First Last.bmp")
+    assert not manifest.is_current(7, fingerprint)
+
+
+def test_update_keeps_other_output_formats(tmp_path):
+    path = str(tmp_path / "7-First Last")
+    manifest = BadgeManifest(str(tmp_path))
+    manifest.update(_result(path, "bmp", "k"), "bmp run")
+    manifest.update(_result(path, "png"), "png run")
+    assert manifest.is_current(7, "png run")
+    assert sorted(os.listdir(tmp_path)) == ["7-First Last.bmp", "7-First Last.k", "7-First Last.png"]
+
+    # The files are named after the crew member, so a name change replaces them all
+    manifest.update(_result(str(tmp_path / "7-First Renamed"), "bmp"), "renamed")
+    assert sorted(os.listdir(tmp_path)) == ["7-First Renamed.bmp"]
+
+    manifest.remove(7)
+    assert os.listdir(tmp_path) == []
+    assert manifest.user_ids == set()
@@ -0,0 +1,38 @@
+import json
+
+import pytest
+
+from polarbadge.service.journal import JOURNAL_FILENAME, RunJournal
+
+
+def test_resume_after_a_crash_mid_line(tmp_path):
+    journal = RunJournal(str(tmp_path), "run")
+    journal.record(10)
+    journal.record(11)
+    journal.close()
+    # The crash hit while 12 was being written
+    with open(tmp_path / JOURNAL_FILENAME, "a") as f:
+        f.write("12")
+
+    journal = RunJournal(str(tmp_path), "run", resume=True)
+    assert journal.completed == {10, 11}
+    journal.record(15)
+    journal.close()
+
+    assert RunJournal(str(tmp_path), "run", resume=True).completed == {10, 11, 15}
+
+
+@pytest.mark.parametrize("header", [json.dumps({"run": "other"}), "[]", '"run"', "not json"])
+def test_journal_of_another_run_starts_fresh(tmp_path, header):
+    (tmp_path / JOURNAL_FILENAME).write_text(f"{header}\n10\n")
+    journal = RunJournal(str(tmp_path), "run", resume=True)
+    assert journal.completed == set()
+    journal.close()
+    assert (tmp_path / JOURNAL_FILENAME).read_text() == json.dumps({"run": "run"}) + "\n"
+
+
+def test_finish_removes_the_journal(tmp_path):
+    journal = RunJournal(str(tmp_path), "run")
+    journal.record(10)
+    journal.finish()
+    assert not (tmp_path / JOURNAL_FILENAME).exists()
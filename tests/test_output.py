@@ -0,0 +1,87 @@
+import struct
+
+import numpy as np
+import pytest
+from PIL import Image as PImage
+
+from polarbadge.parties.pp33.spec import design
+from polarbadge.service.output import BmpEncoder, CmykEncoder, OutputEncoder, RgbEncoder
+
+
+def test_encoder_must_implement_encode():
+    with pytest.raises(TypeError):
+        OutputEncoder()
+
+
+def test_bmp_odd_width(tmp_path):
+    # Rows are bottom up, BGR, padded to 4 bytes: 3 pixels take 9 bytes and 3 of padding
+    pixels = np.array([
+        [[255, 0, 0], [0, 255, 0], [0, 0, 255]],
+        [[1, 2, 3], [4, 5, 6], [7, 8, 9]],
+    ], dtype=np.uint8)
+    data = bytes(BmpEncoder()._encode(pixels, None))
+
+    magic, size, _, _, offset, header_size, width, height, planes, bits, compression, image_size = (
+        struct.unpack_from("<2sIHHIIiiHHII", data)
+    )
+    assert (magic, size, offset, header_size) == (b"BM", 54 + 2 * 12, 54, 40)
+    assert (width, height, planes, bits, compression, image_size) == (3, 2, 1, 24, 0, 2 * 12)
+    assert data[54:66] == bytes([3, 2, 1, 6, 5, 4, 9, 8, 7, 0, 0, 0])
+    assert data[66:78] == bytes([0, 0, 255, 0, 255, 0, 255, 0, 0, 0, 0, 0])
+
+    path = tmp_path / "badge.bmp"
+    path.write_bytes(data)
+    with PImage.open(path) as image:
+        assert np.array_equal(np.asarray(image.convert("RGB")), pixels)
+
+
+@pytest.mark.parametrize("rgb, cmyk", [
+    ((255, 255, 255), (0, 0, 0, 0)),
+    ((0, 0, 0), (0, 0, 0, 255)),
+    ((255, 0, 0), (0, 255, 255, 0)),
+    ((0, 255, 0), (255, 0, 255, 0)),
+    ((0, 0, 255), (255, 255, 0, 0)),
+    ((0, 255, 255), (255, 0, 0, 0)),
+    ((255, 0, 255), (0, 255, 0, 0)),
+    ((255, 255, 0), (0, 0, 255, 0)),
+    ((128, 128, 128), (0, 0, 0, 127)),
+    ((64, 64, 64), (0, 0, 0, 191)),
+    ((128, 64, 0), (0, 127, 255, 127)),
+])
+def test_cmyk(rgb, cmyk):
+    pixels = np.array([[rgb]], dtype=np.uint8)
+    assert tuple(CmykEncoder()._encode(pixels, None)) == cmyk
+
+
+def test_k_panel_pixels_are_left_out_of_colour_panels():
+    pixels = np.zeros((1, 2, 3), dtype=np.uint8)
+    mask = np.array([[True, False]])
+    assert tuple(CmykEncoder()._encode(pixels, mask)) == (0, 0, 0, 0, 0, 0, 0, 255)
+    assert tuple(RgbEncoder()._encode(pixels, mask)) == (255, 255, 255, 0, 0, 0)
+
+
+def test_k_panel_bit_order(tmp_path):
+    # Rows padded to whole bytes, most significant bit first, 1 is resin
+    mask = np.zeros((2, 10), dtype=bool)
+    mask[0, 0] = mask[0, 9] = True
+    mask[1, 1] = mask[1, 8] = True
+    path = RgbEncoder(k_panel=True)._write_k_panel(str(tmp_path / "badge"), mask)
+    assert path == str(tmp_path / "badge.k")
+    with open(path, "rb") as f:
+        assert f.read() == bytes([0b10000000, 0b01000000, 0b01000000, 0b10000000])
+
+
+def test_k_panel_is_in_printer_orientation(tmp_path):
+    # A black card in portrait has resin only in the text and barcode boxes, rotated with the card
+    image = PImage.new("RGB", (design.width_px, design.height_px), "black")
+    files = BmpEncoder(k_panel=True).write(str(tmp_path / "badge"), design, image)
+    assert files == [str(tmp_path / "badge.bmp"), str(tmp_path / "badge.k")]
+    row_bytes = (design.height_px + 7) // 8
+    with open(files[1], "rb") as f:
+        packed = np.frombuffer(f.read(), dtype=np.uint8).reshape(design.width_px, row_bytes)
+    mask = np.unpackbits(packed, axis=1)[:, :design.height_px].astype(bool)
+    code = design.code_2d_box
+    left, top = design.mm_to_px(code.anchor_x_mm), design.mm_to_px(code.anchor_y_mm)
+    # Pillow's ROTATE_90 is counter-clockwise, the design's (x, y) lands on (y, width - 1 - x)
+    assert mask[design.width_px - 1 - left, top]
+    assert not mask[design.width_px - 1, 0]
@@ -0,0 +1,22 @@
+from io import BytesIO
+
+import pytest
+from PIL import Image as PImage
+
+from polarbadge.parties.pp33.spec import design
+from polarbadge.service.picture import normalize_picture
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" width="10" height="10"><rect width="10" height="10"/></svg>'
+
+
+@pytest.mark.parametrize("content", [SVG, b"\x00\x00\x00\x18ftypheic", b"\xff\xd8 truncated"])
+def test_undecodable_picture_is_passed_through(content, tmp_path):
+    assert normalize_picture(content, design, cache_path=str(tmp_path)) == content
+
+
+def test_picture_is_scaled_to_the_profile_box():
+    picture = BytesIO()
+    PImage.new("RGB", (2000, 1000), "grey").save(picture, format="JPEG")
+    with PImage.open(BytesIO(normalize_picture(picture.getvalue(), design, face_crop=False))) as image:
+        box = design.image_profile
+        assert image.size == (design.mm_to_px(box.width_mm), design.mm_to_px(box.height_mm))
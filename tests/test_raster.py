@@ -0,0 +1,27 @@
+import os
+
+import pytest
+from PIL import Image as PImage
+
+from polarbadge.parties.pp33.spec import design
+from polarbadge.service.raster import compare_images, render_image
+
+# Drawn without a picture, so it holds the layers, the text boxes and the barcode. Shifting any of
+# them by a pixel changes about 0.1% of the card, antialiasing differences between FreeType
+# versions stay well below the threshold of compare_images.
+REFERENCE = os.path.join(os.path.dirname(__file__), "data", "pp33_raster.png")
+SUBJECT = {"nick": "Nick", "name": "Full Name", "crew": "Crew", "user_id": 1234}
+
+
+def test_matches_reference():
+    with PImage.open(REFERENCE) as reference:
+        image = render_image(design, **SUBJECT)
+        assert image.size == reference.size
+        diff = compare_images(reference, image)
+    assert diff.changed < 0.0005
+
+
+@pytest.mark.parametrize("content", [b"<svg/>", b"\x00\x00\x00\x18ftypheic", b"\xff\xd8 truncated"])
+def test_unreadable_picture_is_left_out(content):
+    image = render_image(design, **SUBJECT, profile_picture_content=content)
+    assert compare_images(render_image(design, **SUBJECT), image).changed == 0
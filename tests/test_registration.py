@@ -0,0 +1,105 @@
+import csv
+
+import pytest
+
+from polarbadge.service.registration import (
+    AlreadyRegistered, CardInUse, MemberHasCard, Registration, RegistrationStore
+)
+
+KARI = Registration(1, "04a1b2", "kari", "Kari Nordmann", "Tech")
+OLA = Registration(2, "04C3D4", "ola", "Ola Nordmann", "Info")
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "users.csv")
+
+
+@pytest.fixture
+def desks(path):
+    # Two registration desks sharing the users file
+    first, second = RegistrationStore(path), RegistrationStore(path)
+    yield first, second
+    first.close()
+    second.close()
+
+
+def test_conflicts_across_desks(desks):
+    first, second = desks
+    assert first.add(KARI).nfc_id == "04A1B2"
+
+    with pytest.raises(AlreadyRegistered):
+        second.add(KARI._replace(nfc_id=" 04A1b2 "))
+    with pytest.raises(CardInUse) as conflict:
+        second.add(OLA._replace(nfc_id="04A1B2"))
+    assert conflict.value.existing.member_id == KARI.member_id
+    with pytest.raises(MemberHasCard):
+        second.add(KARI._replace(nfc_id="04FFFF"))
+    with pytest.raises(MemberHasCard):
+        second.check(KARI.member_id, "04FFFF")
+    second.check(OLA.member_id, OLA.nfc_id)
+
+
+def test_replace_card(desks):
+    first, second = desks
+    first.add(KARI)
+    second.add(KARI._replace(nfc_id="04ffff"), replace=True)
+
+    first.refresh()
+    assert first.get_by_member(KARI.member_id).nfc_id == "04FFFF"
+    assert first.get_by_nfc("04ffff").member_id == KARI.member_id
+    # The old card is free again
+    assert first.get_by_nfc(KARI.nfc_id) is None
+    first.add(OLA._replace(nfc_id=KARI.nfc_id))
+    assert len(first) == 2
+
+
+def test_catches_up_on_other_desks(desks, path):
+    first, second = desks
+    first.add(KARI)
+    second.add(OLA)
+    assert first.get_by_member(OLA.member_id) is None
+    first.refresh()
+    assert first.get_by_nfc(OLA.nfc_id) == OLA
+
+    # A line still being written by another desk is left until it is complete
+    with open(path, "a") as f:
+        f.write("3,04EEEE,per,Per")
+    first.refresh()
+    assert first.get_by_member(3) is None
+    with open(path, "a") as f:
+        f.write(" Hansen,Tech\n")
+    first.refresh()
+    assert first.get_by_member(3) == Registration(3, "04EEEE", "per", "Per Hansen", "Tech")
+
+
+def test_reads_legacy_rows(path):
+    with open(path, "w") as f:
+        # Written without quoting, and from before the crew column
+        f.write("1,04a1b2,kari,Nordmann, Kari,Tech\n2,04C3D4,ola,Ola Nordmann\nnot a row\n")
+    store = RegistrationStore(path)
+    assert store.get_by_member(1) == Registration(1, "04A1B2", "kari", "Nordmann, Kari", "Tech")
+    assert store.get_by_member(2) == Registration(2, "04C3D4", "ola", "Ola Nordmann", "")
+    # New lines are quoted, so they read back the same
+    store.add(Registration(3, "04EEEE", "per", "Hansen, Per", "Tech, Info"))
+    store.close()
+    store = RegistrationStore(path)
+    assert store.get_by_member(3).full_name == "Hansen, Per"
+    store.close()
+
+
+def test_export_csv(desks, tmp_path):
+    first, second = desks
+    first.add(OLA)
+    second.add(KARI)
+    second.add(KARI._replace(nfc_id="04FFFF"), replace=True)
+
+    export = str(tmp_path / "export.csv")
+    assert first.export_csv(export) == 2
+    with open(export, newline="") as f:
+        rows = list(csv.reader(f))
+    assert rows == [
+        list(Registration._fields),
+        ["1", "04FFFF", "kari", "Kari Nordmann", "Tech"],
+        ["2", "04C3D4", "ola", "Ola Nordmann", "Info"],
+    ]
@@ -0,0 +1,98 @@
+import json
+
+import pytest
+
+from polarbadge.service.roster import RosterStore
+
+
+def _member(user_id: int, crew: str = "Tech", **fields) -> dict:
+    return {
+        "user_id": user_id, "username": f"user{user_id}", "email": f"user{user_id}@example.com",
+        "first_name": "First", "last_name": f"Last {user_id}", "phone": "", "address1": "", "address2": "",
+        "postal_code": "", "postal_name": "", "user_card": f"card{user_id}", "profile_image": f"/{user_id}.jpg",
+        "crew": crew, "role": "Crew", **fields,
+    }
+
+
+class _Response:
+    def __init__(self, members: list[dict] | None, etag: str):
+        self.status_code = 304 if members is None else 200
+        self.headers = {"ETag": etag}
+        self._body = json.dumps({str(m["user_id"]): m for m in members or []}).encode("utf-8")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def iter_content(self, chunk_size: int):
+        return (self._body[i:i + 7] for i in range(0, len(self._body), 7))
+
+
+class _Client:
+    def __init__(self):
+        self.members: list[dict] = []
+
+    def get_crew_list(self, etag: str | None = None) -> _Response:
+        current = str(hash(json.dumps(self.members)))
+        return _Response(None if etag == current else self.members, current)
+
+
+@pytest.fixture
+def roster(tmp_path):
+    roster = RosterStore(str(tmp_path / "roster.sqlite3"))
+    yield roster
+    roster.close()
+
+
+def _member_writes(roster: RosterStore) -> list[str]:
+    statements = []
+    roster._db.set_trace_callback(statements.append)
+    return statements
+
+
+def test_first_sync(roster):
+    client = _Client()
+    client.members = [_member(3), _member(1, crew="Info"), _member(2)]
+    result = roster.sync(client)
+    assert (result.added, result.updated, result.removed) == (3, 0, 0)
+    assert [member.user_id for member in roster.summaries()] == [3, 1, 2]
+    assert [member.user_id for member in roster.summaries(crews=["Tech"])] == [3, 2]
+    assert roster.get(1).user_card == "card1"
+    assert roster.synced_at is not None
+
+
+def test_unchanged_list_is_not_modified(roster):
+    client = _Client()
+    client.members = [_member(1)]
+    roster.sync(client)
+    assert roster.sync(client).not_modified
+
+
+def test_delta_sync_writes_only_changed_members(roster):
+    client = _Client()
+    client.members = [_member(1), _member(2), _member(3)]
+    roster.sync(client)
+
+    client.members = [_member(1), _member(2, role="Chief"), _member(3), _member(4)]
+    statements = _member_writes(roster)
+    result = roster.sync(client)
+    assert (result.added, result.updated, result.removed) == (1, 1, 0)
+    assert len([s for s in statements if s.startswith("INSERT OR REPLACE INTO member")]) == 2
+    assert roster.summaries(user_ids=[2])[0].role == "Chief"
+
+
+def test_removal_keeps_the_rest_in_place(roster):
+    client = _Client()
+    client.members = [_member(user_id) for user_id in range(1, 6)]
+    roster.sync(client)
+
+    del client.members[1]
+    statements = _member_writes(roster)
+    result = roster.sync(client)
+    assert (result.added, result.updated, result.removed) == (0, 0, 1)
+    assert not [s for s in statements if s.startswith("INSERT OR REPLACE INTO member")]
+    assert [member.user_id for member in roster.summaries()] == [1, 3, 4, 5]
+    assert roster.get(2) is None
+    assert len(roster) == 4